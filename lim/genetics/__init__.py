@@ -9,4 +9,8 @@ from . import heritability
 from . import phenotype
 from . import qtl
 from . import variance
+from . import power
+from . import server
 from .model import CanonicalModel
+from .background import BackgroundCache
+from .background import StoredBackground
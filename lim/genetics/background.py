@@ -1,6 +1,606 @@
+from __future__ import division
+
+import logging
+from threading import Lock
+
+from cachetools import LRUCache
+
+from numpy import argsort
+from numpy import asarray
+from numpy import ascontiguousarray
+from numpy import bincount
+from numpy import copyto
+from numpy import empty
+from numpy import empty_like
+from numpy import finfo
+from numpy import hstack
+from numpy import ix_
+from numpy import load
+from numpy import newaxis
+from numpy import ones
+from numpy import packbits
+from numpy import savez
+from numpy import sqrt
+from numpy import zeros
+from numpy.linalg import eigh
+from numpy.linalg import norm
+from numpy.linalg import svd
+from numpy.random import RandomState
+from scipy.linalg import qr
+from scipy.sparse import csr_matrix
+from scipy.sparse import issparse
+from scipy.sparse.csgraph import connected_components
+
+from numpy_sugar import is_all_finite
+from numpy_sugar.linalg import (economic_qs, economic_qs_linear)
+
+from ..tool.kinship import gower_normalization
+from ..tool.kinship import linear_kinship
+from ..tool.normalize import OnlineStandardizer
+from ..util import memory
+
+
 class Background(object):
     def __init__(self):
         self.provided_via_variants = False
         self.nvariants = None
         self.constant_nvariants = None
         self.covariance_rank = None
+        self.candidate_missing_rates = None
+
+
+def standardize_markers(X, skipna=False, block_size=1024):
+    """Standardize the columns of X in place, block by block.
+
+    Missing entries are mean-imputed in the same pass when `skipna` is set.
+    Constant columns, including constant non-integer dosages, are set to
+    zero. Columns are also divided by the square root of the number of
+    columns.
+    """
+    st = OnlineStandardizer(X.shape[1], skipna)
+    scale = sqrt(X.shape[1])
+    for j in range(0, X.shape[1], block_size):
+        B = X[:, j:j + block_size]
+        st.partial_fit(B, start=j)
+        st.transform(B, start=j, out=B)
+        B /= scale
+    return st
+
+
+def background_decomposition(G, K, background=None, impute=False):
+    """Normalize the genetic background in place and decompose it.
+
+    Returns:
+        tuple: ``(Q0, Q1, S0)``, the economic eigen decomposition of the
+        normalized background covariance.
+    """
+    logger = logging.getLogger(__name__)
+
+    if background is None:
+        background = Background()
+
+    if not impute and G is not None and not is_all_finite(G):
+        raise ValueError("The genetic markers matrix G has non-finite values.")
+
+    if K is not None and not is_all_finite(K.data if issparse(K) else K):
+        raise ValueError("The Kinship matrix K has non-finite values.")
+
+    if K is not None:
+        background.provided_via_variants = False
+        logger.info('Covariace matrix normalization.')
+        gower_normalization(K, out=K)
+
+    if G is not None:
+        background.provided_via_variants = True
+        background.nvariants = G.shape[1]
+
+        logger.info('Genetic markers normalization.')
+        st = standardize_markers(G, impute)
+        background.constant_nvariants = st.constant.sum()
+
+    if G is None and K is None:
+        raise Exception('G and K cannot be both None.')
+
+    logger.info('Computing the economic eigen decomposition.')
+    if K is None:
+        QS = economic_qs_linear(G)
+    elif issparse(K):
+        QS = sparse_economic_qs(K)
+    else:
+        QS = economic_qs(K)
+
+    Q0, Q1 = QS[0]
+    S0 = QS[1]
+
+    background.background_rank = len(S0)
+
+    return (Q0, Q1, S0)
+
+
+def sparse_economic_qs(K, epsilon=sqrt(finfo(float).eps)):
+    """Economic eigen decomposition of a sparse covariance matrix.
+
+    Samples are split into the connected components of the graph defined by
+    the non-zero entries of `K` (e.g., the families of a pedigree), and the
+    diagonal blocks are decomposed one by one. The cost is thus the sum of
+    the cubed block sizes instead of the cube of the sample size. The
+    eigenvectors are returned as dense matrices, with the same threshold on
+    eigenvalues as :func:`numpy_sugar.linalg.economic_qs`; together they
+    take :math:`N^2` elements, as for a dense decomposition.
+
+    There is nothing to gain when all the samples are connected (e.g., a
+    single large pedigree): `K` is then decomposed as a dense matrix, in
+    :math:`O(N^3)` time.
+
+    Returns:
+        tuple: ``((Q0, Q1), S0)``.
+    """
+    n = K.shape[0]
+    K = csr_matrix(K)
+    (ncomps, labels) = connected_components(K, directed=False)
+
+    if ncomps == 1:
+        logging.getLogger(__name__).info(
+            'The samples form a single connected component: decomposing K '
+            'as a dense matrix.')
+        return economic_qs(K.toarray())
+
+    order = argsort(labels, kind='mergesort')
+    sizes = bincount(labels)
+
+    blocks = []
+    start = 0
+    for size in sizes:
+        idx = order[start:start + size]
+        (S, V) = eigh(K[idx][:, idx].toarray())
+        ok = S >= epsilon
+        blocks.append((idx, S[ok], V[:, ok], V[:, ~ok]))
+        start += size
+
+    # Eigenvectors of each block are written in place into Q0 and Q1, whose
+    # columns are those of the non-zero and zero eigenvalues respectively.
+    k = sum(len(b[1]) for b in blocks)
+    Q0 = zeros((n, k))
+    Q1 = zeros((n, n - k))
+    S0 = empty(k)
+
+    (j0, j1) = (0, 0)
+    while blocks:
+        (idx, S, V0, V1) = blocks.pop(0)
+        S0[j0:j0 + len(S)] = S
+        Q0[idx, j0:j0 + len(S)] = V0
+        Q1[idx, j1:j1 + V1.shape[1]] = V1
+        j0 += len(S)
+        j1 += V1.shape[1]
+
+    return ((Q0, Q1), S0)
+
+
+def update_economic_qs(QS, K, tol=1e-6, nprobes=10, epsilon=sqrt(finfo(
+        float).eps), random_state=None):
+    """Economic eigen decomposition of a covariance grown by new samples.
+
+    `QS` is the decomposition of the covariance of the first :math:`N_0`
+    samples and `K` the covariance of all :math:`N` samples, the new ones
+    last. The eigenvectors are sought by Rayleigh-Ritz in the span of the
+    old eigenvectors :math:`\\mathrm Q_0`, of the new samples, and of the
+    parts of :math:`\\mathrm K_{01}` and :math:`\\mathrm K_{00}\\mathrm
+    Q_0` orthogonal to :math:`\\mathrm Q_0`, which costs
+    :math:`O(N^2 (r + m))` for rank :math:`r` and :math:`m` new samples
+    instead of :math:`O(N^3)`. The update is exact if the old block of `K`
+    is the old covariance up to a scale factor (e.g., the same kinship
+    matrix, Gower-normalized over the grown cohort). A kinship matrix
+    recomputed from markers standardized over the grown cohort changes the
+    old block by more than a scale factor; the update is then approximate
+    and, most likely, recomputed by the error check below.
+
+    The relative error :math:`\\|\\mathrm K\\mathbf z - \\mathrm Q_0\\mathrm
+    S_0\\mathrm Q_0^\\intercal\\mathbf z\\|/\\|\\mathrm K\\mathbf z\\|`
+    is estimated with `nprobes` random vectors :math:`\\mathbf z`; above
+    `tol`, the decomposition is recomputed from scratch.
+
+    Args:
+        QS (tuple): ``(Q0, Q1, S0)`` of the old samples.
+        K (array_like): Covariance of all the samples
+                        (:math:`N\\times N`).
+        tol (float): Largest accepted relative error. Defaults to `1e-6`.
+        nprobes (int): Number of probe vectors. Defaults to `10`.
+        epsilon (float): Eigenvalues below it are dropped, as in
+                         :func:`numpy_sugar.linalg.economic_qs`.
+        random_state (RandomState): Source of the probe vectors.
+
+    Returns:
+        tuple: ``(Q0, Q1, S0)`` of all the samples and the estimated
+        relative error of the update.
+    """
+    logger = logging.getLogger(__name__)
+
+    K = asarray(K, float)
+    (Q0, _, S0) = QS
+    (n, k) = Q0.shape
+    m = K.shape[0] - n
+
+    if m < 0:
+        raise ValueError('K must include the samples of the decomposition.')
+
+    if random_state is None:
+        random_state = RandomState(0)
+
+    K00 = K[:n, :n]
+    K01 = K[:n, n:]
+    KQ0 = K00.dot(Q0)
+
+    # Directions of the old samples missing from span(Q0).
+    R = hstack([K01, KQ0])
+    R -= Q0.dot(Q0.T.dot(R))
+    (U, s, _) = svd(R, full_matrices=False)
+    if len(s) > 0:
+        U = U[:, s > epsilon * max(s.max(), 1)]
+
+    if k + U.shape[1] + m >= n + m:
+        logger.info('The update is not cheaper than a full decomposition.')
+        return (_economic_qs(K), 0.0)
+
+    B0 = hstack([Q0, U])
+    KB0 = hstack([KQ0, K00.dot(U)])
+    T = empty((B0.shape[1] + m, ) * 2)
+    r = B0.shape[1]
+    T[:r, :r] = B0.T.dot(KB0)
+    T[:r, r:] = B0.T.dot(K01)
+    T[r:, :r] = T[:r, r:].T
+    T[r:, r:] = K[n:, n:]
+    T = (T + T.T) / 2
+
+    (S, W) = eigh(T)
+    ok = S >= epsilon
+    (S, W) = (S[ok], W[:, ok])
+
+    Q = empty((n + m, len(S)))
+    Q[:n] = B0.dot(W[:r])
+    Q[n:] = W[r:]
+
+    Z = random_state.randn(n + m, nprobes)
+    KZ = K.dot(Z)
+    error = norm(KZ - Q.dot(S[:, newaxis] * Q.T.dot(Z))) / max(
+        norm(KZ), finfo(float).tiny)
+
+    if error > tol:
+        logger.info('Updated decomposition error %.2e is above %.2e; '
+                    'recomputing it.', error, tol)
+        return (_economic_qs(K), error)
+
+    # The complement of the eigenvectors from a full QR factorization.
+    (F, _) = qr(Q, mode='full')
+    return ((Q, F[:, len(S):], S), error)
+
+
+def _economic_qs(K):
+    ((Q0, Q1), S0) = economic_qs(K)
+    return (Q0, Q1, S0)
+
+
+def subset_background(G, K, sample_mask=None):
+    """Float copies of G and K restricted to the masked samples."""
+    if sample_mask is None:
+        return (_clone(G), _clone(K))
+
+    sample_mask = asarray(sample_mask, bool)
+
+    if G is not None:
+        G = ascontiguousarray(asarray(G)[sample_mask], float)
+
+    if K is not None and issparse(K):
+        K = csr_matrix(K, dtype=float)[sample_mask][:, sample_mask]
+    elif K is not None:
+        K = asarray(K)[ix_(sample_mask, sample_mask)]
+        K = ascontiguousarray(K, float)
+
+    return (G, K)
+
+
+def background_within_budget(G, K, sample_mask=None, memory_limit=None,
+                             nthreads=None, impute=False):
+    """Float copies of the masked background fitting in a memory budget.
+
+    Decomposing the markers needs a float copy of them and a factor of
+    :math:`N\\times\\min(N, P_b)` elements. When that does not fit in
+    `memory_limit`, the kinship matrix is computed from blocks of `G`
+    instead (see :func:`lim.tool.kinship.linear_kinship`) and returned in
+    place of it, the markers being standardized over the masked samples (and
+    mean-imputed with `impute`) as they would be before decomposing them.
+    The kinship matrix and its eigen decomposition take about
+    :math:`3N^2` elements.
+
+    Returns:
+        tuple: ``(G, K)``, as in :func:`subset_background`.
+    """
+    if memory_limit is None or G is None:
+        return subset_background(G, K, sample_mask)
+
+    limit = memory.parse_memory(memory_limit)
+    (n, p) = G.shape
+    m = n if sample_mask is None else int(asarray(sample_mask, bool).sum())
+    if 8 * m * (2 * p + min(m, p)) <= limit:
+        return subset_background(G, K, sample_mask)
+
+    # Room left for the kinship of the cohort once the decomposition of the
+    # masked one is accounted for.
+    needed = 2 * 8 * m * m
+    if needed >= limit:
+        raise MemoryError(
+            'The memory limit of %s is too small: at least %s are needed.' %
+            (memory.format_memory(limit), memory.format_memory(needed)))
+
+    logging.getLogger(__name__).info(
+        'Computing the kinship matrix to stay within the memory limit.')
+    K = linear_kinship(G, nthreads=nthreads, memory_limit=limit - needed,
+                       sample_mask=sample_mask, impute=impute)
+    return (None, K)
+
+
+def _clone(X):
+    if X is None:
+        return None
+    if issparse(X):
+        return csr_matrix(X, dtype=float, copy=True)
+    Y = empty_like(X, dtype=float, order='C')
+    copyto(Y, X)
+    return Y
+
+
+class BackgroundCache(object):
+    """Genetic background with decompositions cached by sample mask.
+
+    The background is given once, for the whole cohort, via either `G` or `K`.
+    Each distinct sample mask pays a single normalization and eigen
+    decomposition of the corresponding subset of samples; later requests
+    with the same mask reuse it. The least recently used decompositions are
+    dropped once `maxsize` masks are held.
+
+    Args:
+        G (array_like): Genetic markers matrix used internally for kinship
+                        estimation. Dimension (:math:`N\\times P_b`).
+        K (array_like): Kinship matrix, possibly sparse. Dimension
+                        (:math:`N\\times N`).
+        maxsize (int): Maximum number of cached decompositions. Defaults to
+                       `8`.
+        impute (bool): Mean-imputes non-finite entries of `G`. Defaults to
+                       `False`.
+    """
+
+    def __init__(self, G=None, K=None, maxsize=8, impute=False):
+        if (G is None) == (K is None):
+            raise ValueError('Exactly one of G and K must be provided.')
+
+        self._G = G
+        self._K = K
+        self._impute = impute
+        self._cache = LRUCache(maxsize)
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # Pickled along with its decompositions (e.g., sent to processes
+        # started by spawn); the lock is not picklable.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @property
+    def nsamples(self):
+        """Number of samples in the cohort."""
+        if self._G is not None:
+            return self._G.shape[0]
+        return self._K.shape[0]
+
+    def decomposition(self, sample_mask=None, background=None):
+        """Economic eigen decomposition of the masked background.
+
+        Args:
+            sample_mask (array_like): Samples to keep. Defaults to all.
+            background (Background): Filled with background information.
+
+        Returns:
+            tuple: ``(Q0, Q1, S0)``.
+        """
+        key = self._key(sample_mask)
+
+        with self._lock:
+            entry = self._cache.get(key)
+
+        if entry is None:
+            info = Background()
+            (G, K) = subset_background(self._G, self._K, sample_mask)
+            QS = background_decomposition(G, K, info, self._impute)
+            entry = (QS, info)
+            with self._lock:
+                self._cache[key] = entry
+
+        if background is not None:
+            background.__dict__.update(entry[1].__dict__)
+
+        return entry[0]
+
+    def _key(self, sample_mask):
+        if sample_mask is None:
+            return None
+
+        sample_mask = asarray(sample_mask, bool)
+        if len(sample_mask) != self.nsamples:
+            raise ValueError('The sample mask must have one entry per sample.')
+
+        if sample_mask.all():
+            return None
+
+        return packbits(sample_mask).tobytes()
+
+
+def save_decomposition(filename, G=None, K=None, sample_mask=None,
+                       impute=False, memory_limit=None):
+    """Decompose the background once and store it for other processes.
+
+    The decomposition is written to a ``.npz`` file read by
+    :class:`StoredBackground`, so that independent scans (e.g., the shards
+    of a genome-wide scan) share it instead of recomputing it. Several
+    sample masks (e.g., of traits with different missing values) can be
+    given; one decomposition is stored for each distinct mask.
+
+    Args:
+        filename (str): Output file.
+        G (array_like): Genetic markers matrix of the whole cohort.
+        K (array_like): Kinship matrix of the whole cohort.
+        sample_mask (array_like): Samples to keep, or one mask per row.
+                                  Defaults to all.
+        impute (bool): Mean-imputes non-finite entries of `G`. Defaults to
+                       `False`.
+        memory_limit (int or str): Memory budget, as in
+                                   :func:`background_within_budget`.
+    """
+    n = G.shape[0] if G is not None else K.shape[0]
+    if sample_mask is None:
+        sample_mask = ones(n, bool)
+    masks = asarray(sample_mask, bool).reshape((-1, n))
+    masks = masks[sorted(set(_unique_rows(masks)))]
+
+    decompositions = []
+    for mask in masks:
+        (H, L) = background_within_budget(G, K, mask, memory_limit,
+                                          impute=impute)
+        decompositions.append(background_decomposition(H, L, impute=impute))
+
+    _save_decompositions(filename, masks, decompositions)
+
+
+def _save_decompositions(filename, masks, decompositions):
+    arrays = dict(sample_masks=masks)
+    for (i, (Q0, Q1, S0)) in enumerate(decompositions):
+        arrays.update({'Q0_%d' % i: Q0, 'Q1_%d' % i: Q1, 'S0_%d' % i: S0})
+
+    with open(filename, 'wb') as f:
+        savez(f, **arrays)
+
+
+def _unique_rows(masks):
+    # Index of the first occurrence of each row.
+    first = dict()
+    return [first.setdefault(m.tobytes(), i) for (i, m) in enumerate(masks)]
+
+
+class StoredBackground(object):
+    """Background decompositions read from a file.
+
+    It is a drop-in replacement of :class:`BackgroundCache` (e.g., the
+    `cache` parameter of :func:`lim.genetics.qtl.scan`) for the sample masks
+    the stored decompositions were computed for (see
+    :func:`save_decomposition`). Decompositions are read from the file when
+    first requested.
+
+    Args:
+        filename (str): File written by :func:`save_decomposition`.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        with load(filename) as f:
+            self._masks = f['sample_masks']
+        self._index = dict((m.tobytes(), i) for (i, m) in enumerate(
+            self._masks))
+        self._QS = dict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @property
+    def nsamples(self):
+        """Number of samples in the cohort."""
+        return self._masks.shape[1]
+
+    @property
+    def sample_masks(self):
+        """Sample masks of the stored decompositions, one per row."""
+        return self._masks
+
+    def decomposition(self, sample_mask=None, background=None):
+        """Stored economic eigen decomposition.
+
+        Args:
+            sample_mask (array_like): Samples to keep; they must be those of
+                                      a stored decomposition. Defaults to
+                                      all.
+            background (Background): Filled with background information.
+
+        Returns:
+            tuple: ``(Q0, Q1, S0)``.
+        """
+        if sample_mask is None:
+            sample_mask = ones(self.nsamples, bool)
+        sample_mask = asarray(sample_mask, bool)
+
+        i = None
+        if sample_mask.shape == (self.nsamples, ):
+            i = self._index.get(sample_mask.tobytes())
+        if i is None:
+            raise ValueError('No stored background decomposition was '
+                             'computed for this set of samples.')
+
+        with self._lock:
+            if i not in self._QS:
+                with load(self._filename) as f:
+                    self._QS[i] = (f['Q0_%d' % i], f['Q1_%d' % i],
+                                   f['S0_%d' % i])
+            QS = self._QS[i]
+
+        if background is not None:
+            background.background_rank = len(QS[2])
+
+        return QS
+
+    def update(self, K, filename, tol=1e-6, random_state=None):
+        """Store the decompositions of a cohort grown by new samples.
+
+        Each stored decomposition is updated by :func:`update_economic_qs`
+        rather than recomputed, its sample mask being extended to the new
+        samples. The old samples must come first in `K`, which should be the
+        kinship matrix the stored decompositions were computed from,
+        extended to the new samples: the update is exact when the block of
+        the old samples is unchanged up to a scale factor, and recomputed
+        from scratch when its estimated error exceeds `tol`.
+
+        Args:
+            K (array_like): Kinship matrix of the grown cohort.
+            filename (str): Output file, as for :func:`save_decomposition`.
+            tol (float): Largest accepted relative error. Defaults to
+                         `1e-6`.
+            random_state (RandomState): Source of the probe vectors.
+
+        Returns:
+            :class:`StoredBackground`: The updated decompositions.
+        """
+        K = asarray(K, float)
+        m = K.shape[0] - self.nsamples
+        if m < 0:
+            raise ValueError('K must include the stored samples first.')
+
+        masks = hstack([self._masks, ones((len(self._masks), m), bool)])
+        decompositions = []
+        for (old, mask) in zip(self._masks, masks):
+            Km = gower_normalization(K[ix_(mask, mask)])
+            (QS, error) = update_economic_qs(
+                self.decomposition(old), Km, tol,
+                random_state=random_state)
+            logging.getLogger(__name__).info(
+                'Background decomposition updated with error %.2e.', error)
+            decompositions.append(QS)
+
+        _save_decompositions(filename, masks, decompositions)
+        return StoredBackground(filename)
@@ -1 +1,7 @@
 from ._estimate import estimate
+
+try:
+    from ._async import estimate_async
+except SyntaxError:
+    # Coroutines need Python 3.6 or later.
+    pass
@@ -0,0 +1,21 @@
+"""Asyncio front-end of heritability estimation (Python 3.6+)."""
+
+import asyncio
+from functools import partial
+
+from ._estimate import estimate
+
+
+async def estimate_async(phenotype, G=None, K=None, covariates=None,
+                         overdispersion=True, sample_mask=None, cache=None,
+                         nthreads=None, executor=None):
+    """Coroutine version of :func:`lim.genetics.heritability.estimate`.
+
+    The estimation runs in `executor` (the default executor of the event
+    loop if ``None``). Cancelling the task returns control at once, but the
+    running optimization finishes in the background.
+    """
+    loop = asyncio.get_event_loop()
+    f = partial(estimate, phenotype, G, K, covariates, overdispersion,
+                sample_mask, cache, nthreads)
+    return await loop.run_in_executor(executor, f)
@@ -1,14 +1,16 @@
 from __future__ import division
 import logging
-from numpy import ascontiguousarray
 
-from numpy import copy
-from numpy import sqrt
+from numpy import asarray
 from numpy import ones
 
-from numpy_sugar.linalg import (economic_qs, economic_qs_linear)
+from ..background import background_decomposition
+from ..background import background_within_budget
+from ...util import memory
+from ...util.threads import blas_threads
 
-def estimate(phenotype, G=None, K=None, covariates=None, overdispersion=True):
+def estimate(phenotype, G=None, K=None, covariates=None, overdispersion=True,
+             sample_mask=None, cache=None, nthreads=None, memory_limit=None):
     """Estimate the so-called narrow-sense heritability.
 
     It supports Bernoulli and Binomial phenotypes (see `outcome_type`).
@@ -22,7 +24,8 @@ def estimate(phenotype, G=None, K=None, covariates=None, overdispersion=True):
                           integers. Dimension (:math:`N\\times 0`).
     :param numpy.ndarray G: Genetic markers matrix used internally for kinship
                     estimation. Dimension (:math:`N\\times P_b`).
-    :param numpy.ndarray K: Kinship matrix. Dimension (:math:`N\\times N`).
+    :param numpy.ndarray K: Kinship matrix, dense or from :mod:`scipy.sparse`.
+                            Dimension (:math:`N\\times N`).
     :param tuple QS: Economic eigen decomposition of the Kinship matrix.
     :param numpy.ndarray covariate: Covariates. Default is an offset.
                                   Dimension (:math:`N\\times S`).
@@ -31,65 +34,66 @@ def estimate(phenotype, G=None, K=None, covariates=None, overdispersion=True):
     :param float prevalence: Population rate of cases for dichotomous
                              phenotypes. Typically useful for case-control
                              studies.
+    :param numpy.ndarray sample_mask: Samples to be analysed. `G`, `K` and
+                                      `covariates` refer to the whole cohort
+                                      while the phenotype refers to the
+                                      masked samples only.
+    :param cache: A :class:`lim.genetics.background.BackgroundCache` instance
+                  replacing `G` and `K`, whose decompositions are reused
+                  across calls with the same sample mask.
+    :param int nthreads: Maximum number of BLAS threads during the call.
+                         Defaults to no limit.
+    :param memory_limit: Memory budget (e.g., ``'4GB'``). When decomposing
+                         `G` would not fit in it, the kinship matrix is
+                         computed block by block and decomposed instead.
+                         The process peak memory is logged at the end.
     :return: a tuple containing the estimated heritability and additional
              information, respectively.
     """
     logger = logging.getLogger(__name__)
     logger.info('Heritability estimation has started.')
 
-    G, K = _background_standardize(G, K)
+    if cache is not None and (G is not None or K is not None):
+        raise ValueError('G and K cannot be used together with cache.')
 
-    if G is None and K is None:
-        raise Exception('G and K cannot be all None.')
+    start = memory.peak_memory()
 
-    Q0, Q1, S0 = _background_decomposition(G, K)
+    if sample_mask is not None:
+        sample_mask = asarray(sample_mask, bool)
+        if sample_mask.sum() != phenotype.sample_size:
+            raise ValueError("The phenotype must have one value for each" +
+                             " masked sample.")
+        if covariates is not None:
+            covariates = asarray(covariates)[sample_mask]
 
-    if covariates is None:
-        logger.debug('Inserting offset covariate.')
-        covariates = ones((phenotype.sample_size, 1))
+    with blas_threads(nthreads):
+        if cache is None:
+            if G is None and K is None:
+                raise Exception('G and K cannot be all None.')
+            (G, K) = background_within_budget(G, K, sample_mask,
+                                              memory_limit, nthreads)
+            Q0, Q1, S0 = background_decomposition(G, K)
+        else:
+            Q0, Q1, S0 = cache.decomposition(sample_mask)
 
-    logger.debug('Constructing EP.')
-    from limix_inference.glmm import ExpFamEP
-    ep = ExpFamEP(phenotype.to_likelihood(), covariates, Q0, Q1, S0,
-                  overdispersion)
+        S0 = S0 / S0.mean()
 
-    logger.debug('EP optimization.')
-    ep.learn()
+        if covariates is None:
+            logger.debug('Inserting offset covariate.')
+            covariates = ones((phenotype.sample_size, 1))
 
-    h2 = ep.heritability
-    logger.info('Found heritability before correction: %.5f.', h2)
-
-    return h2
-
-def _background_standardize(G, K):
-    from ...tool.normalize import stdnorm
-    from ...tool.kinship import gower_normalization
-    logger = logging.getLogger(__name__)
+        logger.debug('Constructing EP.')
+        from limix_inference.glmm import ExpFamEP
+        ep = ExpFamEP(phenotype.to_likelihood(), covariates, Q0, Q1, S0,
+                      overdispersion)
 
-    if K is not None:
-        logger.debug('Covariace matrix normalization.')
-        K = copy(K, 'C')
-        K = ascontiguousarray(K, dtype=float)
-        gower_normalization(K, K)
+        logger.debug('EP optimization.')
+        ep.learn()
 
-    if G is not None:
-        logger.debug('Genetic markers normalization.')
-        G = copy(G, 'C')
-        G = ascontiguousarray(G, dtype=float)
-        stdnorm(G, 0, out=G)
-        G /= sqrt(G.shape[1])
-
-    return (G, K)
-
-
-def _background_decomposition(G, K):
-    if G is None:
-        (Q, S0) = economic_qs(K)
-    else:
-        (Q, S0) = economic_qs_linear(G)
+    h2 = ep.heritability
+    logger.info('Found heritability before correction: %.5f.', h2)
 
-    Q0 = Q[0]
-    Q1 = Q[1]
-    S0 /= S0.mean()
+    if memory_limit is not None:
+        memory.log_peak_memory(logger, memory_limit, start)
 
-    return Q0, Q1, S0
+    return h2
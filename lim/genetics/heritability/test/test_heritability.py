@@ -3,6 +3,9 @@ from __future__ import division
 from numpy.random import RandomState
 from numpy.testing import assert_allclose
 
+import pytest
+
+from lim.genetics.background import BackgroundCache
 from lim.genetics.heritability import estimate
 from lim.random.canonical import bernoulli as bernoulli_sampler
 
@@ -29,5 +32,48 @@ def test_heritability_binomial_estimate():
                     0.764203044134016, rtol=1e-4, atol=1e-4)
 
 
+def test_heritability_sample_mask():
+    random = RandomState(1)
+    N = 200
+    X = random.randn(N, N + 1)
+    ntrials = random.randint(1, 100, size=N)
+    y = binomial_sampler(ntrials, 0.1, X, random_state=random)
+
+    mask = random.rand(N) < 0.8
+    pheno = BinomialPhenotype(y[mask], ntrials[mask])
+    h2 = estimate(pheno, X[mask])
+
+    assert_allclose(estimate(pheno, X, sample_mask=mask), h2)
+
+    cache = BackgroundCache(G=X)
+    assert_allclose(estimate(pheno, sample_mask=mask, cache=cache), h2)
+    assert_allclose(estimate(pheno, sample_mask=mask, cache=cache), h2)
+
+    with pytest.raises(ValueError):
+        estimate(BinomialPhenotype(y, ntrials), X, sample_mask=mask)
+
+
+def test_heritability_estimate_async():
+    from lim.genetics import heritability
+    from lim.genetics.phenotype import NormalPhenotype
+
+    if not hasattr(heritability, 'estimate_async'):
+        pytest.skip('Coroutines need Python 3.6 or later.')
+
+    import asyncio
+
+    random = RandomState(0)
+    G = random.randn(100, 30)
+    y = NormalPhenotype(G.dot(random.randn(30)) / 5 + random.randn(100))
+
+    loop = asyncio.new_event_loop()
+    try:
+        h2 = loop.run_until_complete(heritability.estimate_async(y, G=G))
+    finally:
+        loop.close()
+
+    assert_allclose(h2, estimate(y, G=G))
+
+
 if __name__ == '__main__':
     __import__('pytest').main([__file__, '-s'])
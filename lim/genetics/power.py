@@ -0,0 +1,211 @@
+"""Statistical power of association scans estimated by simulation."""
+
+from __future__ import absolute_import, division
+
+import logging
+from itertools import product
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+from numpy import asarray
+from numpy import ascontiguousarray
+from numpy import full
+from numpy import unique
+from numpy.random import RandomState
+
+from pandas import DataFrame
+
+from ..random import canonical
+from ..util.threads import threads_per_process
+from . import qtl
+from .background import BackgroundCache
+from .phenotype import BernoulliPhenotype
+from .phenotype import BinomialPhenotype
+from .phenotype import PoissonPhenotype
+
+_likelihoods = ('bernoulli', 'binomial', 'poisson')
+
+_shared = dict()
+
+
+def power_curves(X, G, causal, heritabilities, causal_variances, nreplicates,
+                 likelihood='bernoulli', offset=0, ntrials=None, alpha=0.05,
+                 nprocs=None, seed=0, chunk_size=50, nthreads=None):
+    """Power of the association scan over a grid of simulation settings.
+
+    For each pair of heritability and causal variance, `nreplicates`
+    phenotypes are simulated by :mod:`lim.random.canonical` with `G` as the
+    polygenic background and the columns `causal` of `X` as causal markers.
+    Each phenotype is scanned against `X` by :func:`lim.genetics.qtl.scan`,
+    and power is the fraction of causal markers whose p-value is below
+    `alpha`. A grid point with zero causal variance thus estimates the
+    false positive rate.
+
+    The background decomposition is computed once and shared by all
+    replicates. Replicates are simulated in batches of `chunk_size`, each
+    batch from its own random stream seeded by `seed` and its position in
+    the grid, so results do not depend on the number of processes.
+
+    Args:
+        X (array_like): Candidate markers. Dimension (:math:`N\\times P_c`).
+        G (array_like): Background markers. Dimension (:math:`N\\times P_b`).
+        causal (array_like): Indices of the causal columns of `X`.
+        heritabilities (array_like): Heritabilities to be simulated.
+        causal_variances (array_like): Variances explained by the causal
+                                       markers to be simulated.
+        nreplicates (int): Number of replicates per grid point.
+        likelihood (str): ``'bernoulli'`` (default), ``'binomial'`` or
+                          ``'poisson'``.
+        offset (float): Offset of the latent phenotype. Defaults to `0`.
+        ntrials (array_like): Number of trials for the binomial likelihood.
+        alpha (float): Significance level. Defaults to `0.05`.
+        nprocs (int): Number of processes. Defaults to the number of CPUs.
+        seed (int): Seed of the random streams. Defaults to `0`.
+        chunk_size (int): Replicates simulated per batch. Defaults to `50`.
+        nthreads (int): Maximum number of BLAS threads per process.
+                        Defaults to the number of CPUs shared among the
+                        processes.
+
+    Returns:
+        :class:`pandas.DataFrame`: One row per grid point, with columns
+        `heritability`, `causal_variance`, `power` and `nreplicates`. The
+        latter counts the replicates that could be scanned: replicates
+        with a single outcome value (e.g., no case), and binomial ones
+        rejected by :class:`lim.genetics.phenotype.BinomialPhenotype`, are
+        left out.
+    """
+    logger = logging.getLogger(__name__)
+
+    likelihood = likelihood.lower()
+    if likelihood not in _likelihoods:
+        raise ValueError("Likelihood must be one of %s." % str(_likelihoods))
+
+    if likelihood == 'binomial' and ntrials is None:
+        raise ValueError("The binomial likelihood requires ntrials.")
+
+    X = ascontiguousarray(X, float)
+    causal = asarray(causal, int)
+    if ntrials is not None:
+        ntrials = asarray(ntrials, float)
+        if ntrials.ndim == 0:
+            ntrials = full(X.shape[0], ntrials)
+
+    grid = list(product(heritabilities, causal_variances))
+    for (h2, cv) in grid:
+        if cv < 0 or cv > h2 or h2 + cv > 1:
+            raise ValueError("Invalid heritability %g and causal variance %g."
+                             % (h2, cv))
+
+    tasks = []
+    for (i, (h2, cv)) in enumerate(grid):
+        for (j, r) in enumerate(range(0, nreplicates, chunk_size)):
+            tasks.append((i, j, h2, cv, min(chunk_size, nreplicates - r)))
+
+    cache = BackgroundCache(G=G)
+    cache.decomposition()
+
+    if nprocs is None:
+        nprocs = min(len(tasks), cpu_count())
+
+    logger.info('Simulating %d replicates over %d processes.',
+                len(grid) * nreplicates, nprocs)
+
+    if nthreads is None:
+        nthreads = threads_per_process(nprocs)
+
+    # Forked workers inherit the warm background cache without copying it;
+    # under spawn or forkserver, each worker receives a pickled copy of it,
+    # decomposition included.
+    initargs = (X, G, causal, cache, likelihood, offset, ntrials, alpha, seed,
+                nthreads)
+    if nprocs > 1:
+        pool = Pool(nprocs, initializer=_init_worker, initargs=initargs)
+        try:
+            results = pool.map(_run_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(*initargs)
+        try:
+            results = [_run_task(t) for t in tasks]
+        finally:
+            _shared.clear()
+
+    ndetected = [0.0] * len(grid)
+    nscanned = [0] * len(grid)
+    for (t, (d, n)) in zip(tasks, results):
+        ndetected[t[0]] += d
+        nscanned[t[0]] += n
+
+    rows = []
+    for (i, (h2, cv)) in enumerate(grid):
+        power = ndetected[i] / nscanned[i] if nscanned[i] > 0 else float('nan')
+        rows.append((h2, cv, power, nscanned[i]))
+
+    return DataFrame(
+        rows,
+        columns=['heritability', 'causal_variance', 'power', 'nreplicates'])
+
+
+def _init_worker(X, G, causal, cache, likelihood, offset, ntrials, alpha,
+                 seed, nthreads):
+    _shared.update(
+        X=X,
+        G=G,
+        causal=causal,
+        cache=cache,
+        likelihood=likelihood,
+        offset=offset,
+        ntrials=ntrials,
+        alpha=alpha,
+        seed=seed,
+        nthreads=nthreads)
+
+
+def _run_task(task):
+    (i, j, h2, cv, nreplicates) = task
+    s = _shared
+    random = RandomState([s['seed'], i, j])
+
+    X = s['X']
+    causal_variants = X[:, s['causal']] if cv > 0 else None
+
+    args = (s['offset'], s['G'], h2, causal_variants, cv, random)
+    if s['likelihood'] == 'binomial':
+        Y = canonical.binomial(s['ntrials'], *args, nreplicates=nreplicates)
+    elif s['likelihood'] == 'poisson':
+        Y = canonical.poisson(*args, nreplicates=nreplicates)
+    else:
+        Y = canonical.bernoulli(*args, nreplicates=nreplicates)
+
+    ndetected = 0.0
+    nscanned = 0
+    for r in range(Y.shape[1]):
+        # A single outcome value, e.g. no case at all, says nothing about
+        # the markers.
+        if len(unique(Y[:, r])) < 2:
+            continue
+        try:
+            phenotype = _phenotype(s['likelihood'], Y[:, r], s['ntrials'])
+        except ValueError:
+            continue
+        lrt = qtl.scan(
+            phenotype,
+            X,
+            cache=s['cache'],
+            progress=False,
+            options=dict(nthreads=s['nthreads']))
+        pv = lrt.pvalues()[s['causal']]
+        ndetected += (pv < s['alpha']).mean()
+        nscanned += 1
+
+    return (ndetected, nscanned)
+
+
+def _phenotype(likelihood, y, ntrials):
+    if likelihood == 'binomial':
+        return BinomialPhenotype(y, ntrials)
+    if likelihood == 'poisson':
+        return PoissonPhenotype(y)
+    return BernoulliPhenotype(y)
@@ -1 +1,11 @@
 from ._scan import scan
+from .calibration import CalibrationSummary
+from .rotation import RotationCache
+from .shard import merge_shards
+from .shard import write_shard
+
+try:
+    from ._async import scan_async, scan_blocks, setup_scan_async
+except SyntaxError:
+    # Coroutines need Python 3.6 or later.
+    pass
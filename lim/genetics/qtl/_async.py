@@ -0,0 +1,78 @@
+"""Asyncio front-end of the association scan (Python 3.6+)."""
+
+import asyncio
+from functools import partial
+from threading import Event
+
+from ._scan import _setup_scan
+from ...util.threads import blas_threads
+
+
+async def scan_async(phenotype, X, G=None, K=None, covariates=None,
+                     options=None, sample_mask=None, cache=None,
+                     rotation_cache=None, executor=None):
+    """Coroutine version of :func:`lim.genetics.qtl.scan`.
+
+    The heavy phases run in `executor` (the default executor of the event
+    loop if ``None``), so the loop stays responsive. Cancelling the task
+    stops the scan once the block of markers being tested is done.
+
+    Returns:
+        The same object as :func:`lim.genetics.qtl.scan`.
+    """
+    qtl = await setup_scan_async(phenotype, X, G, K, covariates, options,
+                                 sample_mask, cache, rotation_cache, executor)
+    async for _ in scan_blocks(qtl, executor):
+        pass
+    return qtl
+
+
+async def setup_scan_async(phenotype, X, G=None, K=None, covariates=None,
+                           options=None, sample_mask=None, cache=None,
+                           rotation_cache=None, executor=None):
+    """Preprocess the inputs of a scan without fitting any model.
+
+    The returned object is meant for :func:`scan_blocks`.
+    """
+    loop = asyncio.get_event_loop()
+    setup = partial(_setup_scan, phenotype, X, G, K, covariates, False,
+                    options, sample_mask, cache, rotation_cache)
+    return await loop.run_in_executor(executor, setup)
+
+
+async def scan_blocks(qtl, executor=None):
+    """Fit the models of a scan, one block of markers at a time.
+
+    The null model is fitted first. Then, for each completed block of
+    `options['block_size']` candidate markers, yields a tuple with the
+    slice of markers, their log marginal likelihoods and their effect
+    sizes. Cancellation takes effect between blocks: the block being tested
+    is finished in the executor but its results are discarded. The scan
+    object is left without valid results; a new iteration or
+    :meth:`compute_statistics` restarts the scan from the first block.
+    """
+    loop = asyncio.get_event_loop()
+    nthreads = qtl._options.get('nthreads')
+    cancel = Event()
+
+    def run(f, *args):
+        with blas_threads(nthreads):
+            return f(*args)
+
+    await loop.run_in_executor(executor, run, qtl._compute_null_model)
+
+    blocks = qtl._alt_model_blocks(cancel)
+    try:
+        while True:
+            cols = await loop.run_in_executor(executor, run, next, blocks,
+                                              None)
+            if cols is None:
+                break
+            yield (cols, qtl._alt_lmls[cols].copy(),
+                   qtl._effect_sizes[cols].copy())
+    finally:
+        # Also reached when the task is cancelled or the iteration dropped:
+        # the block still running in the executor ends the iteration. It
+        # writes into the arrays of this iteration only, which a restarted
+        # scan replaces.
+        cancel.set()
@@ -0,0 +1,133 @@
+from __future__ import absolute_import, division
+
+from numpy import asarray
+from numpy import ascontiguousarray
+from numpy import einsum
+from numpy import finfo
+from numpy import float64
+from numpy import hstack
+from numpy import log
+from numpy import nan
+from numpy import newaxis
+from numpy import sqrt
+from numpy import where
+from numpy.linalg import pinv
+
+LOG2PI = 1.837877066409345339081937709124758839607238769531250
+
+
+class NormalScanKernel(object):
+    """Association statistics of many markers against a Normal phenotype.
+
+    The null covariance is
+    :math:`s((1-\\delta)\\mathrm Q_0\\mathrm S_0\\mathrm Q_0^\\intercal +
+    \\delta\\mathrm I)`, with :math:`\\delta` fitted under the null. Each
+    marker is added to the covariates and its effect size and log marginal
+    likelihood are found by generalized least squares, with the scale
+    profiled out. The marker block is rotated by a single product with
+    :math:`[\\mathrm Q_0 ~ \\mathrm M ~ \\mathbf y]`; the part of the
+    rotation orthogonal to :math:`\\mathrm Q_0` follows from
+    :math:`\\mathrm Q_1\\mathrm Q_1^\\intercal = \\mathrm I -
+    \\mathrm Q_0\\mathrm Q_0^\\intercal`, and the marker coefficient from
+    the Schur complement of the covariates, for all markers at once.
+
+    With `dtype` set to `float32`, markers are expected in single precision
+    and the rotation is carried out in single precision too; the rotated
+    products are promoted to double precision before any other step.
+
+    Args:
+        y (array_like): Phenotype. Dimension (:math:`N\\times 0`).
+        M (array_like): Covariates. Dimension (:math:`N\\times S`).
+        Q0 (array_like): Eigenvectors of the background with non-zero
+                         eigenvalues.
+        S0 (array_like): Non-zero eigenvalues of the background.
+        delta (float): Fraction of the variance due to the noise.
+        dtype (data-type): Precision of the rotation. Defaults to `float64`.
+    """
+
+    def __init__(self, y, M, Q0, S0, delta, dtype=float64):
+        n = len(y)
+        (r, c) = (Q0.shape[1], M.shape[1])
+
+        self._n = n
+        self._tol = finfo(dtype).eps**0.5
+        self._r = r
+        self._c = c
+        self._W = ascontiguousarray(hstack([Q0, M, y[:, newaxis]]), dtype)
+
+        d0 = S0 * (1 - delta) + delta
+        self._d1 = delta
+        self._w = 1 / d0 - 1 / delta
+
+        self._Q0M = Q0.T.dot(M)
+        self._Q0y = Q0.T.dot(y)
+
+        A00 = self._inner(self._Q0M, self._Q0M, M.T.dot(M))
+        b0 = self._inner(self._Q0M, self._Q0y, M.T.dot(y))
+        yy = self._inner(self._Q0y, self._Q0y, y.dot(y))
+
+        self._A00i = pinv(A00)
+        self._Ab0 = self._A00i.dot(b0)
+        self._quad0 = yy - b0.dot(self._Ab0)
+        self._logdet = log(d0).sum() + (n - r) * log(delta)
+
+    def _inner(self, Ru, Rv, UV):
+        # U^T K^{-1} V from the rotations Q0^T U, Q0^T V and from U^T V.
+        return (Ru.T * self._w).dot(Rv) + UV / self._d1
+
+    def scan(self, X, rotated=None):
+        """Log marginal likelihoods and effect sizes of the columns of X.
+
+        `rotated` optionally holds :math:`\\mathrm Q_0^\\intercal\\mathrm X`
+        and the squared norms of the columns of X, computed beforehand (e.g.,
+        by :class:`lim.genetics.qtl.RotationCache`); X is then only
+        multiplied by the covariates and the phenotype.
+        """
+        return self.statistics(X, rotated)[:2]
+
+    def statistics(self, X, rotated=None):
+        """Association statistics of the columns of X.
+
+        Besides what :meth:`scan` returns, the standard errors of the effect
+        sizes and the effects of the covariates fitted along each marker
+        follow from the same Schur complement, with the scale at its
+        maximum likelihood estimate.
+
+        Returns:
+            tuple: Log marginal likelihoods, effect sizes, their standard
+            errors (:math:`P_c`) and covariate effect sizes
+            (:math:`S\\times P_c`).
+        """
+        (r, c) = (self._r, self._c)
+
+        if rotated is None:
+            P = ascontiguousarray(self._W.T.dot(X), float64)
+            xx = einsum('ij,ij->j', X, X).astype(float64)
+            R = P[:r]
+            P = P[r:]
+        else:
+            R = asarray(rotated[0], float64)
+            xx = asarray(rotated[1], float64)
+            P = ascontiguousarray(self._W[:, r:].T.dot(X), float64)
+
+        a11 = einsum('ij,ij->j', R * self._w[:, newaxis], R) + xx / self._d1
+        a01 = self._inner(self._Q0M, R, P[:c])
+        bm = self._inner(self._Q0y, R, P[-1])
+
+        s = a11 - einsum('ij,ij->j', a01, self._A00i.dot(a01))
+        t = bm - self._Ab0.dot(a01)
+
+        # Markers explained by the covariates up to the working precision.
+        ok = s > self._tol * a11
+        s = where(ok, s, 1)
+        effsizes = where(ok, t / s, 0)
+        quad = self._quad0 - where(ok, t * t / s, 0)
+
+        n = self._n
+        lmls = -n * LOG2PI - n - self._logdet - n * log(quad / n)
+        lmls /= 2
+
+        se = where(ok, sqrt(quad / n / s), nan)
+        covariates = self._Ab0[:, newaxis] - self._A00i.dot(a01) * effsizes
+
+        return (lmls, effsizes, se, covariates)
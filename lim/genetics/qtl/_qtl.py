@@ -2,19 +2,24 @@ from __future__ import absolute_import, unicode_literals
 
 import logging
 from copy import copy
+from hashlib import sha1
 from operator import attrgetter
 
-from numpy import asarray, empty, nan
-from scipy_sugar.stats import quantile_gaussianize
+from numpy import (arange, asarray, ascontiguousarray, empty, errstate,
+                   flatnonzero, full, nan, zeros)
 
 from limix_inference.glmm import ExpFamEP
 from limix_inference.lmm import FastLMM
 from numpy_sugar.linalg import economic_qs
 
 from ..phenotype import NormalPhenotype
+from ...util.preprocess import quantile_gaussianize
+from ._fast import NormalScanKernel
+from .calibration import CalibrationSummary
 
 class QTLScan(object):
-    def __init__(self, phenotype, covariates, X, Q0, Q1, S0, options):
+    def __init__(self, phenotype, covariates, X, Q0, Q1, S0, options,
+                 missing_rates=None, rotated=None):
         self._logger = logging.getLogger(__name__)
         self.progress = True
 
@@ -30,7 +35,16 @@ class QTLScan(object):
         self._null_lml = nan
         self._alt_lmls = None
         self._effect_sizes = None
+        self._effect_sizes_se = None
+        self._covariate_effect_sizes = None
+        self._calibration = None
+        self._refined = None
+        self._representatives = None
+        self._monomorphic = None
+        self._shard = None
         self._options = options
+        self._missing_rates = missing_rates
+        self._rotated = rotated
 
     @property
     def candidate_markers(self):
@@ -45,6 +59,7 @@ class QTLScan(object):
     @candidate_markers.setter
     def candidate_markers(self, X):
         self._X = X
+        self._rotated = None
         self._valid_alt_models = False
 
     def compute_statistics(self):
@@ -69,20 +84,158 @@ class QTLScan(object):
         self._valid_null_model = True
 
     def _compute_alt_models(self):
+        for _ in self._alt_model_blocks():
+            pass
+
+    def _alt_model_blocks(self, cancel=None):
+        """Compute the alternative models block by block.
+
+        Yields the slice of candidate markers of each completed block. The
+        results are only flagged as valid once the last block is done.
+        Once `cancel` (a :class:`threading.Event`) is set, the remaining
+        blocks are skipped.
+
+        Each call allocates new result arrays and only ever writes into
+        them, so a block still running after a cancellation cannot touch
+        the results of a restarted scan.
+        """
         if self._valid_alt_models:
             return
 
-        if self._options['fast']:
-            al, es = _fast_scan(self._method, self._covariates, self._X,
-                                self.progress)
-        else:
-            al, es = _slow_scan(self._method, self._covariates, self._X,
-                                self.progress)
-
-        self._alt_lmls, self._effect_sizes = al, es
+        scan = self._block_scan()
+
+        p = self._X.shape[1]
+        block_size = self._options.get('block_size') or max(p, 1)
+
+        self._alt_lmls = alt_lmls = empty(p)
+        self._effect_sizes = effect_sizes = empty(p)
+        self._effect_sizes_se = effect_sizes_se = full(p, nan)
+        self._covariate_effect_sizes = covariate_effect_sizes = full(
+            (p, self._covariates.shape[1]), nan)
+        self._refined = refined = zeros(p, bool)
+        self._representatives = representatives = arange(p)
+        self._monomorphic = monomorphic = zeros(p, bool)
+        self._calibration = calibration = CalibrationSummary()
+
+        dedup = self._options.get('dedup', True)
+        first = dict()
+
+        # Statistics reach the calibration summary block by block, so the
+        # inflation factor is ready without a second pass over the results.
+        for i in range(0, p, block_size):
+            if _is_set(cancel):
+                return
+            cols = slice(i, min(i + block_size, p))
+            index = arange(cols.start, cols.stop)
+
+            if dedup:
+                (rep, mono) = _unique_columns(self._X[:, cols], i, first)
+                representatives[cols] = rep
+                monomorphic[cols] = mono
+            else:
+                (rep, mono) = (index, zeros(len(index), bool))
+
+            tested = (rep == index) & ~mono
+            if tested.any():
+                (al, es, se, ce) = scan(cols if tested.all() else
+                                        index[tested])
+                alt_lmls[index[tested]] = al
+                effect_sizes[index[tested]] = es
+                if se is not None:
+                    effect_sizes_se[index[tested]] = se
+                if ce is not None:
+                    covariate_effect_sizes[index[tested]] = ce.T
+
+                refit = self._refine(index[tested], alt_lmls)
+                if refit is not None:
+                    (idx, al, es, ce) = refit
+                    alt_lmls[idx] = al
+                    effect_sizes[idx] = es
+                    effect_sizes_se[idx] = nan
+                    covariate_effect_sizes[idx] = ce.T
+                    refined[idx] = True
+
+            # Duplicates come after the marker they repeat, whose statistics
+            # are thus already known.
+            dup = index[~tested & ~mono]
+            src = rep[dup - i]
+            alt_lmls[dup] = alt_lmls[src]
+            effect_sizes[dup] = effect_sizes[src]
+            effect_sizes_se[dup] = effect_sizes_se[src]
+            covariate_effect_sizes[dup] = covariate_effect_sizes[src]
+            refined[dup] = refined[src]
+
+            alt_lmls[index[mono]] = self._null_lml
+            effect_sizes[index[mono]] = 0
+
+            calibration.update(2 * (alt_lmls[index[~mono]] - self._null_lml))
+            yield cols
 
         self._valid_alt_models = True
 
+    def _refine(self, index, alt_lmls):
+        """Refit exactly the given markers below `options['refine']`.
+
+        Returns the refitted markers, their alternative log marginal
+        likelihoods, effect sizes and covariate effect sizes, or `None`.
+        """
+        threshold = self._options.get('refine')
+        if threshold is None or not self._options['fast'] or len(index) == 0:
+            return None
+
+        from scipy.stats import chi2
+
+        lrs = 2 * (alt_lmls[index] - self._null_lml)
+        idx = index[chi2(df=1).sf(lrs) < threshold]
+        if len(idx) == 0:
+            return None
+
+        self._logger.info('Refitting %d markers exactly.', len(idx))
+        (al, es, ce) = _slow_scan(self._method, self._covariates,
+                                  asarray(self._X[:, idx], float), False)
+        return (idx, al, es, ce)
+
+    def _block_scan(self):
+        method = self._method
+        covariates = self._covariates
+        X = self._X
+
+        # Each function returns the alternative log marginal likelihoods,
+        # the effect sizes, their standard errors and the covariate effect
+        # sizes of the given markers; the last two can be None.
+        if not self._options['fast']:
+
+            def slow(cols):
+                (al, es, ce) = _slow_scan(method, covariates,
+                                          asarray(X[:, cols], float),
+                                          self.progress)
+                return (al, es, None, ce)
+
+            return slow
+
+        normal = self._phenotype.likelihood_name.lower() == 'normal'
+        if normal:
+            # Lim's own kernel yields standard errors and covariate effects
+            # along the likelihoods, rotates single-precision markers and
+            # reuses cached rotations; the null model and the statistics
+            # stay in double precision.
+            g = method.genetic_variance
+            e = method.environmental_variance
+            kernel = NormalScanKernel(
+                _normal_outcome(self._phenotype, self._options), covariates,
+                self._Q0, self._S0, e / (g + e), X.dtype)
+
+            if self._rotated is None:
+                return lambda cols: kernel.statistics(X[:, cols])
+
+            (Q0X, xx) = self._rotated
+            return lambda cols: kernel.statistics(X[:, cols],
+                                                  (Q0X[:, cols], xx[cols]))
+
+        return lambda cols: _fast_scan(method, covariates,
+                                       asarray(X[:, cols], float),
+                                       self.progress) + (None, None)
+
     def null_lml(self):
         """Log marginal likelihood for the null hypothesis."""
         self.compute_statistics()
@@ -98,8 +251,95 @@ class QTLScan(object):
         self.compute_statistics()
         return self._effect_sizes
 
-    def pvalues(self):
-        """Association p-value for candidate markers."""
+    def candidate_effect_sizes_se(self):
+        """Standard errors of the effect sizes of candidate markers.
+
+        They come from the generalized least squares fit of each marker, so
+        they are only available for Normal phenotypes tested by the fast
+        scan. They are NaN otherwise, including for refitted and monomorphic
+        markers.
+        """
+        self.compute_statistics()
+        return self._effect_sizes_se
+
+    def wald_statistics(self):
+        """Wald statistics of candidate markers.
+
+        They are the squared ratios of the effect sizes to their standard
+        errors, chi-squared distributed with one degree of freedom under the
+        null hypothesis, and NaN where the standard errors are not
+        available.
+        """
+        se = self.candidate_effect_sizes_se()
+        with errstate(divide='ignore', invalid='ignore'):
+            return (self._effect_sizes / se)**2
+
+    def covariate_effect_sizes(self):
+        """Effect sizes of the covariates fitted along each marker.
+
+        They are not available (NaN) for markers of non-Normal phenotypes
+        tested by the fast scan, nor for monomorphic ones.
+
+        :returns: array (:math:`P_c\\times S`).
+        """
+        self.compute_statistics()
+        return self._covariate_effect_sizes
+
+    def refined_markers(self):
+        """Markers whose statistics come from an exact refit.
+
+        With `options['refine']` set, markers whose fast-scan p-value is
+        below it are refitted one by one, as with `fast` disabled.
+
+        :returns: boolean array (:math:`P_c`).
+        """
+        self.compute_statistics()
+        return self._refined
+
+    def monomorphic_markers(self):
+        """Markers without variation, which are not tested.
+
+        Their p-values are one and their effect sizes zero. Markers are
+        only checked when `options['dedup']` is set (default).
+
+        :returns: boolean array (:math:`P_c`).
+        """
+        self.compute_statistics()
+        return self._monomorphic
+
+    def duplicate_markers(self):
+        """First marker identical to each candidate marker.
+
+        Identical markers (after standardization) are tested once, and the
+        statistics of the first one are copied to the others. Unique
+        markers map to themselves.
+
+        :returns: integer array (:math:`P_c`).
+        """
+        self.compute_statistics()
+        return self._representatives
+
+    def candidate_missing_rates(self):
+        """Fraction of missing calls for candidate markers."""
+        if self._missing_rates is None:
+            return zeros(self._X.shape[1])
+        return self._missing_rates
+
+    def calibration(self):
+        """Calibration summary of the association statistics.
+
+        :returns: :class:`lim.genetics.qtl.CalibrationSummary` with the
+                  genomic-control inflation factor and binned QQ data.
+        """
+        self.compute_statistics()
+        return self._calibration
+
+    def pvalues(self, genomic_control=False):
+        """Association p-value for candidate markers.
+
+        :param genomic_control: divides the statistics by the genomic-control
+                                inflation factor when it is greater than one.
+        """
         self.compute_statistics()
 
         lml_alts = self.alt_lmls()
@@ -107,17 +347,47 @@ class QTLScan(object):
 
         lrs = -2 * lml_null + 2 * asarray(lml_alts)
 
+        if genomic_control:
+            return self._calibration.corrected_pvalues(lrs)
+
         from scipy.stats import chi2
         chi2 = chi2(df=1)
 
         return chi2.sf(lrs)
 
+def _is_set(event):
+    return event is not None and event.is_set()
+
+
+def _unique_columns(B, start, first):
+    """Monomorphic columns of a block and the first copy of the others.
+
+    Standardization sets constant markers to zero, so monomorphic columns
+    are the zero ones. `first` maps the hash of each column seen so far to
+    its index and is updated with the new ones.
+    """
+    B = asarray(B)
+    mono = ~B.any(0)
+    rep = arange(start, start + B.shape[1])
+
+    Bt = ascontiguousarray(B.T)
+    for j in flatnonzero(~mono):
+        key = sha1(Bt[j].data).digest()
+        rep[j] = first.setdefault(key, start + j)
+
+    return (rep, mono)
+
+
+def _normal_outcome(phenotype, options):
+    y = phenotype.outcome
+    if options['rank_norm']:
+        y = quantile_gaussianize(y)
+    return y
+
 def _get_method(phenotype, Q0, Q1, S0, covariates, options):
 
     if phenotype.likelihood_name.lower() == 'normal':
-        y = phenotype.outcome
-        if options['rank_norm']:
-            y = quantile_gaussianize(y)
+        y = _normal_outcome(phenotype, options)
         method = FastLMM(y, Q0=Q0, Q1=Q1, S0=S0, covariates=covariates, options=options)
     else:
         y = phenotype.to_likelihood()
@@ -134,6 +404,7 @@ def _slow_scan(method, covariates, X, progress):
 
     alt_lmls = empty(p)
     effect_sizes = empty(p)
+    covariate_effect_sizes = empty((nc, p))
 
     M = empty((n, nc + 1))
     M[:, :nc] = covariates
@@ -145,8 +416,9 @@ def _slow_scan(method, covariates, X, progress):
         m.learn(progress=False)
         alt_lmls[i] = m.lml()
         effect_sizes[i] = m.beta[-1]
+        covariate_effect_sizes[:, i] = m.beta[:-1]
 
-    return alt_lmls, effect_sizes
+    return alt_lmls, effect_sizes, covariate_effect_sizes
 
 def _fast_scan(method, covariates, X, progress):
     nlt = method.get_normal_likelihood_trick()
@@ -1,32 +1,44 @@
 """Quantitative trait locus discovery."""
 
-from __future__ import absolute_import
+from __future__ import absolute_import, division
 
 import logging
 
-from numpy import sqrt
+from numpy import asarray
 from numpy import ones
+from numpy import sqrt
 from numpy import empty_like
 from numpy import copyto
 
-from numpy_sugar.linalg import (economic_qs, economic_qs_linear)
 from numpy_sugar import is_all_finite
 
 from ._qtl import QTLScan
+from .shard import parse_shard
+from .shard import shard_range
 from ..background import Background
-from ...tool.kinship import gower_normalization
-from ...tool.normalize import stdnorm
+from ..background import background_decomposition
+from ..background import background_within_budget
+from ..background import standardize_markers
+from ...util import memory
+from ...util.threads import blas_threads
 
 def scan(phenotype, X, G=None, K=None, covariates=None, progress=True,
-         options=None):
+         options=None, sample_mask=None, cache=None, rotation_cache=None):
     """Association between genetic variants and phenotype.
 
     Matrix `X` shall contain the genetic markers (e.g., number of minor
     alleles) with rows and columns representing samples and genetic markers,
     respectively.
 
-    The user must specify only one of the parameters `G` and `K` for defining
-    the genetic background.
+    The user must specify only one of the parameters `G`, `K` and `cache` for
+    defining the genetic background.
+
+    When `sample_mask` is given, `X`, `G`, `K` and `covariates` refer to the
+    whole cohort and are restricted to the masked samples, while the
+    phenotype refers to the masked samples only. Scanning several phenotypes
+    with the same missingness pattern against a
+    :class:`lim.genetics.background.BackgroundCache` decomposes the masked
+    background only once.
 
     Let :math:`N` be the sample size, :math:`S` the number of covariates,
     :math:`P_c` the number of genetic markers to be tested, and :math:`P_b`
@@ -41,20 +53,95 @@ def scan(phenotype, X, G=None, K=None, covariates=None, progress=True,
         G          (array_like): Genetic markers matrix used internally for
                                  kinship estimation. Dimension
                                  (:math:`N\\times P_b`).
-        K          (array_like): Kinship matrix. Dimension
-                                 (:math:`N\\times N`).
+        K          (array_like): Kinship matrix, dense or from
+                                 :mod:`scipy.sparse`; sparse matrices are
+                                 decomposed over the connected components
+                                 of their samples (e.g., pedigrees).
+                                 Dimension (:math:`N\\times N`).
         covariates (array_like): Covariates. Default is an offset.
                                  Dimension (:math:`N\\times S`).
         progress    (bool)     : Shows progress. Defaults to `True`.
+        options     (dict)     : Scan options, each with its default:
+
+            - `fast` (`True`): uses the fast scan instead of refitting the
+              model of each marker.
+            - `rank_norm` (`True`): quantile-normalizes Normal phenotypes.
+            - `missing` (`'raise'`): either `'raise'`, which rejects
+              non-finite values in `X` and `G`, or `'impute'`, which
+              treats them as missing calls replaced by the marker mean.
+            - `block_size` (`8192`): number of candidate markers tested per
+              block, whose statistics feed the calibration summary.
+            - `dtype` (`'float64'`): either `'float64'` or `'float32'`,
+              which stores the candidate markers in single precision (see
+              Notes).
+            - `nthreads` (`None`): maximum number of BLAS threads during
+              the call; no limit if `None`.
+            - `memory_limit` (`None`): memory budget, e.g. ``'4GB'`` (see
+              Notes).
+            - `refine` (`None`): p-value threshold below which markers of
+              the fast scan are refitted exactly, one by one (see
+              `refined_markers`).
+            - `dedup` (`True`): tests identical candidate markers only
+              once and skips monomorphic ones, whose p-values are one (see
+              `duplicate_markers` and `monomorphic_markers`).
+            - `shard` (`None`): ``'i/n'`` with :math:`0\\leq i<n` tests
+              only the `i`-th of `n` contiguous ranges of candidate markers
+              (see :mod:`lim.genetics.qtl.shard`).
+
+        sample_mask (array_like): Samples to be analysed. Defaults to all.
+        cache (BackgroundCache): Genetic background with cached
+                                 decompositions, replacing `G` and `K`.
+        rotation_cache (RotationCache): Disk cache of the standardized
+                                 candidate markers and of their rotation
+                                 into the background eigenbasis, reused by
+                                 scans of other phenotypes.
 
     Returns:
         A :class:`lim.genetics.qtl._canonical.CanonicalLRTScan` instance.
+
+    Notes:
+        With `dtype` set to `'float32'`, Normal phenotypes tested by the
+        fast scan also have their candidate markers rotated in single
+        precision. Their statistics agree with the default ones to about
+        :math:`10^{-4}`, in absolute value for the likelihood ratios and in
+        relative value for the effect sizes.
+
+        A `memory_limit` picks `block_size` and, if needed, computes the
+        background kinship block by block, so that the estimated footprint
+        of the candidate markers, of the background decomposition and of
+        the per-block temporaries stays within it. The process peak memory
+        is logged after the scan.
+
+        `refine` is mostly useful for non-Normal phenotypes, whose fast
+        scan is approximate. With `shard`, effect sizes are on the scale of
+        the whole scan.
     """
+    start = memory.peak_memory()
+    qtl = _setup_scan(phenotype, X, G, K, covariates, progress, options,
+                      sample_mask, cache, rotation_cache)
+
+    with blas_threads(qtl._options['nthreads']):
+        qtl.compute_statistics()
+
+    if qtl._options['memory_limit'] is not None:
+        memory.log_peak_memory(logging.getLogger(__name__),
+                               qtl._options['memory_limit'], start)
+
+    return qtl
+
+
+def _setup_scan(phenotype, X, G=None, K=None, covariates=None, progress=True,
+                options=None, sample_mask=None, cache=None,
+                rotation_cache=None):
+    """Everything :func:`scan` does before fitting the models."""
     logger = logging.getLogger(__name__)
     logger.info('%s association scan has started.', phenotype.likelihood_name)
 
-    if options is None:
-        options = dict()
+    # Defaults and the block size picked from the memory budget must not
+    # leak into the caller's dict.
+    options = dict() if options is None else dict(options)
+
+    explicit_block_size = options.get('block_size')
 
     if 'fast' not in options:
         options['fast'] = True
@@ -62,73 +149,141 @@ def scan(phenotype, X, G=None, K=None, covariates=None, progress=True,
     if 'rank_norm' not in options:
         options['rank_norm'] = True
 
-    n = phenotype.sample_size
-    covariates = ones((n, 1)) if covariates is None else covariates
+    if 'block_size' not in options:
+        options['block_size'] = 8192
 
-    X = _clone(X)
-    G = _clone(G)
-    K = _clone(K)
+    if 'dtype' not in options:
+        options['dtype'] = 'float64'
 
-    if not is_all_finite(X):
-        raise ValueError("The candidate matrix X has non-finite values.")
+    if options['dtype'] not in ('float32', 'float64'):
+        raise ValueError("Option 'dtype' must be 'float32' or 'float64'.")
 
-    if G is not None and not is_all_finite(G):
-        raise ValueError("The genetic markers matrix G has non-finite values.")
+    if 'missing' not in options:
+        options['missing'] = 'raise'
 
-    if K is not None and not is_all_finite(K):
-        raise ValueError("The Kinship matrix K has non-finite values.")
+    if 'nthreads' not in options:
+        options['nthreads'] = None
 
-    background = Background()
+    if 'memory_limit' not in options:
+        options['memory_limit'] = None
 
-    (Q0, Q1, S0) = _genetic_preprocess(X, G, K, background)
-    qtl = QTLScan(phenotype, covariates, X, Q0, Q1, S0, options)
-    qtl.progress = progress
-    qtl.compute_statistics()
+    if 'refine' not in options:
+        options['refine'] = None
 
-    return qtl
+    if 'dedup' not in options:
+        options['dedup'] = True
 
-def _genetic_preprocess(X, G, K, background):
-    logger = logging.getLogger(__name__)
-    logger.info("Number of candidate markers to scan: %d", X.shape[1])
+    if 'shard' not in options:
+        options['shard'] = None
+
+    if options['missing'] not in ('raise', 'impute'):
+        raise ValueError("Option 'missing' must be 'raise' or 'impute'.")
 
-    if K is not None:
-        background.provided_via_variants = False
-        logger.info('Covariace matrix normalization.')
-        gower_normalization(K, out=K)
+    impute = options['missing'] == 'impute'
 
-    if G is not None:
-        background.provided_via_variants = True
-        background.nvariants = G.shape[1]
-        background.constant_nvariants = sum(G.std(0) == 0)
+    if cache is not None and (G is not None or K is not None):
+        raise ValueError('G and K cannot be used together with cache.')
+
+    n = phenotype.sample_size
+    if sample_mask is not None:
+        sample_mask = asarray(sample_mask, bool)
+        if sample_mask.sum() != n:
+            raise ValueError("The phenotype must have one value for each" +
+                             " masked sample.")
+        if covariates is not None:
+            covariates = asarray(covariates)[sample_mask]
 
-        logger.info('Genetic markers normalization.')
-        stdnorm(G, 0, out=G)
-        G /= sqrt(G.shape[1])
+    covariates = ones((n, 1)) if covariates is None else covariates
 
-    if G is None and K is None:
-        raise Exception('G and K cannot be both None.')
+    shard = None
+    if options['shard'] is not None:
+        if rotation_cache is not None:
+            raise ValueError("Option 'shard' cannot be used together with "
+                             "rotation_cache.")
+        shard = (parse_shard(options['shard']), X.shape[1])
+        X = X[:, shard_range(options['shard'], X.shape[1])]
+
+    if rotation_cache is None:
+        X = _clone(X, sample_mask, options['dtype'])
+        if not impute and not is_all_finite(X):
+            raise ValueError("The candidate matrix X has non-finite values.")
+    elif sample_mask is not None:
+        X = asarray(X)[sample_mask]
 
-    logger.info('Computing the economic eigen decomposition.')
-    if K is None:
-        QS = economic_qs_linear(G)
-    else:
-        QS = economic_qs(K)
+    background = Background()
 
-    Q0, Q1 = QS[0]
-    S0 = QS[1]
+    with blas_threads(options['nthreads']):
+        if cache is None:
+            (G, K) = background_within_budget(G, K, sample_mask,
+                                              options['memory_limit'],
+                                              options['nthreads'], impute)
+            (Q0, Q1, S0) = background_decomposition(G, K, background, impute)
+        else:
+            (Q0, Q1, S0) = cache.decomposition(sample_mask, background)
+
+        if options['memory_limit'] is not None:
+            size = _budget_block_size(X, Q0, options['memory_limit'],
+                                      rotation_cache is None)
+            if explicit_block_size is not None:
+                size = min(size, explicit_block_size)
+            options['block_size'] = size
+            logger.info('Testing %d candidate markers per block.', size)
+
+        rotated = None
+        if rotation_cache is None:
+            _candidates_preprocess(X, background, impute,
+                                   min(options['block_size'], 1024))
+            if shard is not None and X.shape[1] > 0:
+                # Scale as if all the candidate markers were standardized
+                # together.
+                X *= sqrt(X.shape[1] / shard[1])
+        else:
+            (X, Q0X, xx, missing_rates) = rotation_cache.candidates(
+                X, Q0, S0, options['dtype'], impute)
+            background.candidate_missing_rates = missing_rates
+            rotated = (Q0X, xx)
+
+        qtl = QTLScan(phenotype, covariates, X, Q0, Q1, S0, options,
+                      missing_rates=background.candidate_missing_rates,
+                      rotated=rotated)
+        qtl.progress = progress
+        qtl._shard = shard
 
-    background.background_rank = len(S0)
+    return qtl
 
-    logger.info('Genetic marker candidates normalization.')
-    stdnorm(X, 0, out=X)
-    X /= sqrt(X.shape[1])
+def _budget_block_size(X, Q0, memory_limit, cloned=True):
+    """Block size keeping the estimated footprint of a scan in budget."""
+    (n, p) = X.shape
+    k = Q0.shape[1]
 
-    return (Q0, Q1, S0)
+    # Background eigenvectors, candidate markers held in memory (unless
+    # memory-mapped) and the arrays of results.
+    fixed = 8 * n * n + 3 * 8 * p
+    if cloned:
+        fixed += X.dtype.itemsize * n * p
+
+    # Per marker of a block: standardization temporaries and a double
+    # precision copy of the block, and its rotations into the background
+    # eigenbasis.
+    per_column = 8 * (3 * n + 3 * k)
+
+    return memory.block_size(memory_limit, fixed, per_column, p)
+
+
+def _candidates_preprocess(X, background, impute=False, block_size=1024):
+    logger = logging.getLogger(__name__)
+    logger.info("Number of candidate markers to scan: %d", X.shape[1])
+
+    logger.info('Genetic marker candidates normalization.')
+    st = standardize_markers(X, impute, block_size)
+    background.candidate_missing_rates = st.missing_rate
 
 
-def _clone(X):
+def _clone(X, sample_mask=None, dtype=float):
     if X is None:
         return None
-    Y = empty_like(X, dtype=float, order='C')
+    if sample_mask is not None:
+        X = asarray(X)[sample_mask]
+    Y = empty_like(X, dtype=dtype, order='C')
     copyto(Y, X)
     return Y
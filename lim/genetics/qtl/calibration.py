@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division
+
+from numpy import asarray
+from numpy import bincount
+from numpy import clip
+from numpy import cumsum
+from numpy import digitize
+from numpy import isfinite
+from numpy import linspace
+from numpy import log10
+from numpy import maximum
+from numpy import nan
+from numpy import zeros
+from scipy.stats import chi2
+
+from ...util.sketch import QuantileSketch
+
+_chi2_median = chi2(df=1).median()
+
+
+class CalibrationSummary(object):
+    """Streaming calibration summary of association statistics.
+
+    Likelihood ratio statistics, asymptotically :math:`\\chi^2_1` distributed
+    under the null, are consumed block by block. Their median is tracked by a
+    :class:`lim.util.QuantileSketch`, giving the genomic-control inflation
+    factor, and their :math:`-\\log_{10}` p-values are counted in fixed bins,
+    giving QQ plot data. Memory does not grow with the number of tests.
+
+    Args:
+        nbins (int): Number of QQ bins. Defaults to `200`.
+        max_log10p (float): Upper edge of the last bounded QQ bin; larger
+                            values share an open-ended bin. Defaults to `50`.
+        k (int): Accuracy parameter of the median sketch. Defaults to
+                 `2000`, which keeps the inflation factor within a few
+                 thousandths of the exact one for a few thousand items.
+    """
+
+    def __init__(self, nbins=200, max_log10p=50, k=2000):
+        self._sketch = QuantileSketch(k)
+        self._edges = linspace(0, max_log10p, nbins + 1)
+        self._counts = zeros(nbins + 1)
+        self._sums = zeros(nbins + 1)
+
+    @property
+    def count(self):
+        """Number of statistics consumed."""
+        return self._sketch.count
+
+    def update(self, stats):
+        """Consume a block of likelihood ratio statistics.
+
+        Non-finite statistics (e.g., of failed fits) are left out, of the
+        median as well as of the QQ bins.
+        """
+        stats = asarray(stats, float).ravel()
+        stats = maximum(stats[isfinite(stats)], 0)
+        self._sketch.update(stats)
+
+        logp = -log10(clip(chi2(df=1).sf(stats), 1e-300, 1))
+        i = digitize(logp, self._edges[1:])
+        n = len(self._counts)
+        self._counts += bincount(i, minlength=n)
+        self._sums += bincount(i, weights=logp, minlength=n)
+        return self
+
+    def merge(self, other):
+        """Merge the statistics consumed by another summary."""
+        self._sketch.merge(other._sketch)
+        self._counts += other._counts
+        self._sums += other._sums
+        return self
+
+    def genomic_control(self):
+        """Genomic-control inflation factor :math:`\\lambda`.
+
+        It is the median statistic over the median of :math:`\\chi^2_1`.
+        """
+        if self.count == 0:
+            return nan
+        return self._sketch.quantile(0.5) / _chi2_median
+
+    def qq(self):
+        """Binned QQ plot data.
+
+        Returns:
+            tuple: Expected and observed :math:`-\\log_{10}` p-values, one
+            pair per non-empty bin. The observed value is the bin mean and
+            the expected one corresponds to the middle rank of the bin.
+        """
+        ok = self._counts > 0
+        counts = self._counts[ok]
+        observed = self._sums[ok] / counts
+
+        above = cumsum(counts[::-1])[::-1] - counts
+        rank = above + (counts + 1) / 2
+        expected = -log10(rank / (self.count + 1))
+        return (expected, observed)
+
+    def corrected_pvalues(self, stats):
+        """P-values of `stats` after genomic control.
+
+        Statistics are divided by :math:`\\lambda` when it is greater than
+        one.
+        """
+        lmbd = self.genomic_control()
+        if not lmbd > 1:
+            lmbd = 1
+        return chi2(df=1).sf(asarray(stats, float) / lmbd)
@@ -0,0 +1,383 @@
+"""Command-line batch association scan.
+
+Example::
+
+    lim-scan --phenotype pheno.npy --genotype geno.h5:/X \\
+             --background geno.h5:/G --output results.tsv --chunk-size 4096
+
+Arrays are read from ``.npy`` files or from HDF5 datasets given as
+``file.h5:/path/to/dataset``. Genotypes are samples-by-markers matrices and
+are read, standardized and tested one chunk of markers at a time, so only
+the background and a few chunks are held in memory. Each column of the
+phenotype array is a trait; its missing values exclude the corresponding
+samples. Results are appended to a tab-separated file as chunks complete.
+"""
+
+from __future__ import absolute_import, division
+
+import argparse
+import logging
+import sys
+from copy import copy
+from multiprocessing.pool import ThreadPool
+
+from numpy import arange
+from numpy import asarray
+from numpy import isfinite
+from numpy import load
+from numpy import sqrt
+
+from numpy_sugar import is_all_finite
+
+from ..background import BackgroundCache
+from ..background import StoredBackground
+from ..background import save_decomposition
+from ..background import standardize_markers
+from ..phenotype import BernoulliPhenotype
+from ..phenotype import BinomialPhenotype
+from ..phenotype import NormalPhenotype
+from ..phenotype import PoissonPhenotype
+from ...util.threads import blas_threads
+from ._scan import _clone
+from ._scan import _setup_scan
+from .calibration import CalibrationSummary
+from .shard import merge_shards
+from .shard import results_table
+from .shard import shard_range
+from .shard import write_manifest
+
+
+def read_array(spec, lazy=False):
+    """Array from a ``.npy`` file or from an HDF5 dataset.
+
+    Args:
+        spec (str): ``file.npy`` or ``file.h5:/dataset``. The dataset can be
+                    omitted if the HDF5 file holds a single one.
+        lazy (bool): Returns a memory map or an open HDF5 dataset instead of
+                     reading the whole array. Defaults to `False`.
+    """
+    if spec.endswith('.npy'):
+        X = load(spec, mmap_mode='r' if lazy else None)
+        return X
+
+    import h5py
+
+    (filename, _, name) = spec.partition(':')
+    f = h5py.File(filename, 'r')
+    if not name:
+        names = []
+        f.visititems(lambda n, o: names.append(n)
+                     if isinstance(o, h5py.Dataset) else None)
+        if len(names) != 1:
+            raise ValueError("Please, specify one of the datasets of %s: %s."
+                             % (filename, ', '.join(names)))
+        name = names[0]
+
+    if lazy:
+        return f[name]
+    X = f[name][...]
+    f.close()
+    return X
+
+
+def scan_chunks(phenotype, X, cache, covariates=None, sample_mask=None,
+                options=None, chunk_size=8192, nworkers=1, markers=None):
+    """Scan the candidate markers of a file one chunk at a time.
+
+    The null model is fitted once; each chunk of markers is then read,
+    standardized and tested against it, `nworkers` chunks at a time.
+
+    Args:
+        phenotype: Phenotype of the masked samples.
+        X (array_like): Candidate markers of the whole cohort, possibly an
+                        HDF5 dataset or a memory map.
+        cache (BackgroundCache): Genetic background.
+        covariates (array_like): Covariates of the whole cohort.
+        sample_mask (array_like): Samples to be analysed. Defaults to all.
+        options (dict): Scan options, as in :func:`lim.genetics.qtl.scan`.
+        chunk_size (int): Number of markers per chunk. Defaults to `8192`.
+        nworkers (int): Number of chunks tested in parallel. Defaults to
+                        `1`.
+        markers (slice): Range of candidate markers to test (e.g., a shard).
+                         Defaults to all.
+
+    Yields:
+        tuple: The slice of markers of each chunk, in order, and the scan
+        object holding its statistics.
+    """
+    p = X.shape[1]
+    null = _setup_scan(phenotype, asarray(X[:, :0]), covariates=covariates,
+                       progress=False, options=options,
+                       sample_mask=sample_mask, cache=cache)
+    options = null._options
+    impute = options['missing'] == 'impute'
+
+    with blas_threads(options['nthreads']):
+        null._compute_null_model()
+
+    def run(cols):
+        B = asarray(X[:, cols])
+        B = _clone(B, sample_mask, options['dtype'])
+        if not impute and not is_all_finite(B):
+            raise ValueError("The candidate matrix X has non-finite values.")
+        st = standardize_markers(B, impute)
+        # Scale as if all the candidate markers were standardized together.
+        B *= sqrt(B.shape[1] / p)
+
+        qtl = copy(null)
+        qtl.candidate_markers = B
+        qtl._missing_rates = st.missing_rate
+        with blas_threads(options['nthreads']):
+            qtl.compute_statistics()
+        return (cols, qtl)
+
+    if markers is None:
+        markers = slice(0, p)
+    chunks = [
+        slice(i, min(i + chunk_size, markers.stop))
+        for i in range(markers.start, markers.stop, chunk_size)
+    ]
+    if nworkers <= 1:
+        for cols in chunks:
+            yield run(cols)
+        return
+
+    pool = ThreadPool(nworkers)
+    try:
+        for r in pool.imap(run, chunks):
+            yield r
+    finally:
+        pool.terminate()
+
+
+def _phenotype(likelihood, y, ntrials=None):
+    if likelihood == 'normal':
+        return NormalPhenotype(y)
+    if likelihood == 'bernoulli':
+        return BernoulliPhenotype(y)
+    if likelihood == 'binomial':
+        if ntrials is None:
+            raise ValueError("Binomial phenotypes need --ntrials.")
+        return BinomialPhenotype(y, ntrials)
+    return PoissonPhenotype(y)
+
+
+def _columns(A):
+    A = asarray(A, float)
+    return A.reshape((A.shape[0], -1))
+
+
+def _trait_masks(Y, ntrials=None):
+    """Samples observed in each trait, one row per trait."""
+    masks = isfinite(_columns(Y)).T
+    if ntrials is not None:
+        masks &= isfinite(_columns(ntrials)).T
+    return masks
+
+
+def _parser():
+    p = argparse.ArgumentParser(
+        prog='lim-scan',
+        description='Association scan of phenotypes against genotype files.')
+    p.add_argument('--phenotype',
+                   help='Phenotypes (N or N x T) as file.npy or file.h5:/ds.')
+    p.add_argument('--genotype', help='Candidate markers (N x P).')
+    p.add_argument('--background', help='Background markers (N x Pb).')
+    p.add_argument('--kinship', help='Kinship matrix (N x N).')
+    p.add_argument('--background-file',
+                   help='Background decomposition saved by '
+                   '--save-background.')
+    p.add_argument('--save-background', metavar='FILE',
+                   help='Decompose the background of the samples observed '
+                   'in each trait (all samples without --phenotype), save '
+                   'the decompositions and exit.')
+    p.add_argument('--update-background', metavar='FILE',
+                   help='Update the decompositions of --background-file to '
+                   'the cohort of --kinship, whose first samples are the '
+                   'stored ones, save them and exit.')
+    p.add_argument('--shard', help="Test only the markers of shard 'i/n' "
+                   "(0 <= i < n) and write a manifest for lim-merge.")
+    p.add_argument('--covariates', help='Covariates (N x S).')
+    p.add_argument('--ntrials', help='Number of trials of binomial traits.')
+    p.add_argument('--markers',
+                   help='Tab-separated marker annotation, one row per '
+                   'marker (e.g. chrom, pos, id).')
+    p.add_argument('--likelihood', default='normal',
+                   choices=['normal', 'bernoulli', 'binomial', 'poisson'])
+    p.add_argument('--output', help='Tab-separated file of results.')
+    p.add_argument('--chunk-size', type=int, default=8192,
+                   help='Markers read and tested at a time.')
+    p.add_argument('--workers', type=int, default=1,
+                   help='Chunks tested in parallel.')
+    p.add_argument('--threads', type=int, default=None,
+                   help='BLAS threads (no limit by default).')
+    p.add_argument('--missing', default='raise', choices=['raise', 'impute'])
+    p.add_argument('--dtype', default='float64',
+                   choices=['float64', 'float32'])
+    p.add_argument('--no-rank-norm', action='store_true',
+                   help='Do not quantile-normalize normal traits.')
+    p.add_argument('--slow', action='store_true',
+                   help='Refit every marker instead of the fast scan.')
+    p.add_argument('--refine', type=float, default=None,
+                   help='Refit exactly the markers whose fast-scan p-value '
+                   'is below this threshold.')
+    p.add_argument('--quiet', action='store_true')
+    return p
+
+
+def main(argv=None):
+    """Entry point of ``lim-scan``."""
+    args = _parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    logger = logging.getLogger(__name__)
+
+    if args.update_background is not None:
+        if args.background_file is None or args.kinship is None:
+            raise SystemExit('Please, provide --background-file and '
+                             '--kinship.')
+        StoredBackground(args.background_file).update(
+            read_array(args.kinship), args.update_background)
+        logger.info('Background decomposition saved in %s.',
+                    args.update_background)
+        return 0
+
+    sources = [args.background, args.kinship, args.background_file]
+    if sum(a is not None for a in sources) != 1:
+        raise SystemExit('Please, provide one of --background, --kinship and '
+                         '--background-file.')
+
+    G = None if args.background is None else read_array(args.background)
+    K = None if args.kinship is None else read_array(args.kinship)
+
+    if args.save_background is not None:
+        if args.background_file is not None:
+            raise SystemExit('Please, provide --background or --kinship.')
+        masks = None
+        if args.phenotype is not None:
+            masks = _trait_masks(
+                read_array(args.phenotype), None
+                if args.ntrials is None else read_array(args.ntrials))
+        save_decomposition(args.save_background, G, K, masks,
+                           args.missing == 'impute')
+        logger.info('Background decomposition saved in %s.',
+                    args.save_background)
+        return 0
+
+    for a in ('phenotype', 'genotype', 'output'):
+        if getattr(args, a) is None:
+            raise SystemExit('Please, provide --%s.' % a)
+
+    Y = _columns(read_array(args.phenotype))
+    X = read_array(args.genotype, lazy=True)
+    M = None if args.covariates is None else _columns(
+        read_array(args.covariates))
+    ntrials = None if args.ntrials is None else _columns(
+        read_array(args.ntrials))
+
+    if X.shape[0] != Y.shape[0]:
+        raise SystemExit('Genotype and phenotype have different numbers of '
+                         'samples.')
+
+    markers = None
+    if args.markers is not None:
+        from pandas import read_csv
+        markers = read_csv(args.markers, sep='\t')
+        if len(markers) != X.shape[1]:
+            raise SystemExit('The marker annotation must have one row per '
+                             'candidate marker.')
+
+    masks = _trait_masks(Y, ntrials)
+    if args.background_file is not None:
+        cache = StoredBackground(args.background_file)
+        stored = set(m.tobytes() for m in cache.sample_masks)
+        for (t, mask) in enumerate(masks):
+            if mask.tobytes() not in stored:
+                raise SystemExit(
+                    'The background file has no decomposition for the '
+                    'samples of trait %d; save it with --save-background '
+                    'and the same --phenotype.' % (t + 1))
+    else:
+        cache = BackgroundCache(G=G, K=K, impute=args.missing == 'impute')
+
+    cols = slice(0, X.shape[1])
+    if args.shard is not None:
+        cols = shard_range(args.shard, X.shape[1])
+        logger.info('Shard %s: markers %d to %d.', args.shard, cols.start,
+                    cols.stop)
+
+    header = True
+    null_lmls = []
+    nrows = 0
+    for t in range(Y.shape[1]):
+        mask = masks[t]
+        y = Y[mask, t]
+        n = None if ntrials is None else ntrials[mask, t]
+        phenotype = _phenotype(args.likelihood, y, n)
+
+        options = dict(
+            fast=not args.slow,
+            rank_norm=not args.no_rank_norm,
+            dtype=args.dtype,
+            missing=args.missing,
+            nthreads=args.threads,
+            refine=args.refine)
+
+        logger.info('Scanning trait %d of %d (%d samples).', t + 1,
+                    Y.shape[1], mask.sum())
+
+        calibration = CalibrationSummary()
+        chunks = scan_chunks(phenotype, X, cache, M,
+                             None if mask.all() else mask, options,
+                             args.chunk_size, args.workers, cols)
+        null_lml = None
+        for (chunk, qtl) in chunks:
+            df = results_table(qtl, arange(chunk.start, chunk.stop), t,
+                               markers)
+            df.to_csv(args.output, sep='\t', index=False, mode='w' if header
+                      else 'a', header=header, na_rep='nan')
+            header = False
+            nrows += len(df)
+            null_lml = qtl.null_lml()
+            calibration.merge(qtl.calibration())
+            logger.info('Markers %d to %d done.', chunk.start, chunk.stop)
+
+        null_lmls.append(null_lml)
+        logger.info('Trait %d: genomic-control lambda %.4f.', t + 1,
+                    calibration.genomic_control())
+
+    if args.shard is not None:
+        write_manifest(args.output, args.shard, X.shape[1], null_lmls, nrows,
+                       genotype=args.genotype, phenotype=args.phenotype,
+                       likelihood=args.likelihood)
+
+    return 0
+
+
+def merge_main(argv=None):
+    """Entry point of ``lim-merge``."""
+    p = argparse.ArgumentParser(
+        prog='lim-merge',
+        description='Validate and merge the shards of a lim-scan run.')
+    p.add_argument('shards', nargs='+', help='Results of each shard.')
+    p.add_argument('--output', required=True,
+                   help='Tab-separated file of merged results.')
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    try:
+        (df, lambdas) = merge_shards(args.shards)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    df.to_csv(args.output, sep='\t', index=False, na_rep='nan')
+    for (t, l) in enumerate(lambdas):
+        logger.info('Trait %d: genomic-control lambda %.4f.', t + 1, l)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+from __future__ import absolute_import, division
+
+import logging
+import os
+import shutil
+import tempfile
+from hashlib import sha1
+
+from numpy import ascontiguousarray
+from numpy import asarray
+from numpy import concatenate
+from numpy import einsum
+from numpy import empty
+from numpy import float64
+from numpy import load
+from numpy import save
+from numpy.lib.format import open_memmap
+
+from numpy_sugar import is_all_finite
+
+from ..background import standardize_markers
+
+
+class RotationCache(object):
+    """Disk cache of standardized and rotated candidate markers.
+
+    The fast scan of a Normal phenotype needs the standardized candidate
+    markers :math:`\\mathrm X` and their rotation
+    :math:`\\mathrm Q_0^\\intercal\\mathrm X` into the background eigenbasis,
+    neither of which depends on the phenotype. They are stored as ``.npy``
+    files under `directory`, in a folder named after a hash of the raw
+    markers, of the background decomposition and of the preprocessing
+    options, and are memory-mapped by later scans of new phenotypes.
+
+    Args:
+        directory (str): Cache folder. Created if needed.
+        block_size (int): Number of markers standardized and rotated at a
+                          time when filling the cache. Defaults to `8192`.
+    """
+
+    def __init__(self, directory, block_size=8192):
+        self.directory = directory
+        self.block_size = block_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, X, Q0, S0, dtype='float64', impute=False):
+        """Hash identifying the candidates and the background."""
+        X = asarray(X)
+        h = sha1()
+        h.update(('%s %s %s %s' % (X.shape, X.dtype.str, dtype,
+                                   impute)).encode('ascii'))
+        # Row chunks keep the hashed bytes those of X in C order.
+        rows = max(1, self.block_size * 64 // max(X.shape[1], 1))
+        for i in range(0, X.shape[0], rows):
+            h.update(ascontiguousarray(X[i:i + rows]).data)
+        h.update(ascontiguousarray(Q0, float64).data)
+        h.update(ascontiguousarray(S0, float64).data)
+        return h.hexdigest()
+
+    def candidates(self, X, Q0, S0, dtype='float64', impute=False):
+        """Standardized and rotated candidate markers.
+
+        They are read from the cache, or computed and stored on a miss.
+
+        Returns:
+            tuple: Memory-mapped standardized markers
+            (:math:`N\\times P_c`), their rotation
+            :math:`\\mathrm Q_0^\\intercal\\mathrm X`, the squared norms of
+            their columns, and their missing rates.
+        """
+        key = self.key(X, Q0, S0, dtype, impute)
+        path = os.path.join(self.directory, key)
+
+        if not os.path.isdir(path):
+            logging.getLogger(__name__).info(
+                'Rotating the candidate markers into %s.', path)
+            self._store(path, X, Q0, dtype, impute)
+
+        return tuple(
+            load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in ('X', 'Q0X', 'xx', 'missing'))
+
+    def _store(self, path, X, Q0, dtype, impute):
+        X = asarray(X)
+        (n, p) = X.shape
+        Q0T = ascontiguousarray(Q0.T, dtype)
+
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            Y = open_memmap(
+                os.path.join(tmp, 'X.npy'), mode='w+', dtype=dtype,
+                shape=(n, p))
+            R = open_memmap(
+                os.path.join(tmp, 'Q0X.npy'), mode='w+', dtype=dtype,
+                shape=(Q0T.shape[0], p))
+
+            for j in range(0, p, self.block_size):
+                B = ascontiguousarray(X[:, j:j + self.block_size], dtype)
+                if not impute and not is_all_finite(B):
+                    raise ValueError(
+                        "The candidate matrix X has non-finite values.")
+                Y[:, j:j + B.shape[1]] = B
+
+            st = standardize_markers(Y, impute, self.block_size)
+
+            xx = [empty(0)]
+            for j in range(0, p, self.block_size):
+                B = Y[:, j:j + self.block_size]
+                R[:, j:j + B.shape[1]] = Q0T.dot(B)
+                xx.append(einsum('ij,ij->j', B, B).astype(float64))
+
+            save(os.path.join(tmp, 'xx.npy'), concatenate(xx))
+            save(os.path.join(tmp, 'missing.npy'), st.missing_rate)
+            Y.flush()
+            R.flush()
+            del Y, R
+
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another process filled the same entry meanwhile.
+                shutil.rmtree(tmp, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
@@ -0,0 +1,202 @@
+"""Genome-wide scans split into independent shards of markers.
+
+Each shard tests a contiguous range of candidate markers (see the `shard`
+option of :func:`lim.genetics.qtl.scan`) and writes a tab-separated table of
+results with a JSON manifest next to it. The manifest is written last, so a
+shard is complete if and only if it has one. :func:`merge_shards` validates
+the manifests and assembles the genome-wide table.
+"""
+
+from __future__ import absolute_import, division
+
+import json
+
+from numpy import arange
+from numpy import asarray
+from numpy import allclose
+
+from .calibration import CalibrationSummary
+
+
+def parse_shard(shard):
+    """Shard index and number of shards.
+
+    Args:
+        shard (str or tuple): ``'i/n'`` or ``(i, n)``, with
+                              :math:`0\\leq i < n`.
+
+    Returns:
+        tuple: ``(i, n)``.
+    """
+    if isinstance(shard, (tuple, list)):
+        (i, n) = shard
+    else:
+        try:
+            (i, n) = str(shard).split('/')
+        except ValueError:
+            raise ValueError("Invalid shard '%s': expected 'i/n'." % shard)
+    (i, n) = (int(i), int(n))
+    if not 0 <= i < n:
+        raise ValueError("Invalid shard %d/%d: expected 0 <= i < n." % (i, n))
+    return (i, n)
+
+
+def shard_range(shard, nmarkers):
+    """Slice of the candidate markers tested by a shard."""
+    (i, n) = parse_shard(shard)
+    return slice(i * nmarkers // n, (i + 1) * nmarkers // n)
+
+
+def manifest_filename(filename):
+    """Manifest of the shard whose results are in `filename`."""
+    return filename + '.json'
+
+
+def results_table(qtl, index, trait=0, markers=None):
+    """Table of association results.
+
+    Args:
+        qtl: Scan object.
+        index (array_like): Indices of its candidate markers among all of
+                            them.
+        trait (int): Trait index. Defaults to `0`.
+        markers (pandas.DataFrame): Annotation of all the candidate markers,
+                                    one row per marker.
+
+    Returns:
+        :class:`pandas.DataFrame`: One row per marker.
+    """
+    from pandas import DataFrame
+
+    index = asarray(index)
+    df = DataFrame({'trait': trait, 'marker': index})
+    if markers is not None:
+        annot = markers.iloc[index].reset_index(drop=True)
+        for c in annot.columns:
+            df[c] = annot[c].values
+    df['pvalue'] = qtl.pvalues()
+    df['effsize'] = qtl.candidate_effect_sizes()
+    df['effsize_se'] = qtl.candidate_effect_sizes_se()
+    df['wald'] = qtl.wald_statistics()
+    df['missing'] = qtl.candidate_missing_rates()
+    df['null_lml'] = qtl.null_lml()
+    df['alt_lml'] = qtl.alt_lmls()
+    df['refined'] = qtl.refined_markers()
+    df['monomorphic'] = qtl.monomorphic_markers()
+    return df
+
+
+def write_manifest(filename, shard, nmarkers, null_lmls, nrows, **extra):
+    """Write the manifest of a completed shard.
+
+    Args:
+        filename (str): Results table of the shard.
+        shard (str or tuple): Shard, as in :func:`parse_shard`.
+        nmarkers (int): Number of candidate markers of the whole scan.
+        null_lmls (list): Null log marginal likelihood of each trait.
+        nrows (int): Number of rows of the results table.
+        extra: Other JSON-serializable metadata.
+    """
+    (i, n) = parse_shard(shard)
+    cols = shard_range((i, n), nmarkers)
+    meta = dict(
+        shard=i,
+        nshards=n,
+        start=cols.start,
+        stop=cols.stop,
+        nmarkers=nmarkers,
+        ntraits=len(null_lmls),
+        null_lmls=[float(v) for v in null_lmls],
+        nrows=nrows)
+    meta.update(extra)
+    with open(manifest_filename(filename), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+
+def write_shard(qtl, filename, markers=None):
+    """Write the results of a sharded scan and its manifest.
+
+    Args:
+        qtl: Result of :func:`lim.genetics.qtl.scan` with the `shard`
+             option.
+        filename (str): Tab-separated results table.
+        markers (pandas.DataFrame): Annotation of all the candidate markers.
+    """
+    if qtl._shard is None:
+        raise ValueError("The scan has not been run with the 'shard' "
+                         "option.")
+
+    (shard, nmarkers) = qtl._shard
+    cols = shard_range(shard, nmarkers)
+    df = results_table(qtl, arange(cols.start, cols.stop), 0, markers)
+    df.to_csv(filename, sep='\t', index=False, na_rep='nan')
+    write_manifest(filename, shard, nmarkers, [qtl.null_lml()], len(df))
+
+
+def merge_shards(filenames):
+    """Assemble the results of all the shards of a scan.
+
+    The manifests must exist, agree on the number of shards, of markers and
+    of traits, cover each shard exactly once, and report the same null
+    likelihoods (the same phenotypes against the same background). Each
+    table must have the number of rows stated in its manifest.
+
+    Args:
+        filenames (list): Results tables of the shards.
+
+    Returns:
+        tuple: The merged :class:`pandas.DataFrame`, sorted by trait and
+        marker, and the genomic-control inflation factor of each trait.
+    """
+    from pandas import concat
+    from pandas import read_csv
+
+    metas = []
+    for fn in filenames:
+        try:
+            with open(manifest_filename(fn)) as f:
+                metas.append(json.load(f))
+        except IOError:
+            raise ValueError("Shard %s is incomplete: its manifest is "
+                             "missing." % fn)
+
+    if len(metas) == 0:
+        raise ValueError('No shard to merge.')
+
+    first = metas[0]
+    for (fn, m) in zip(filenames, metas):
+        for k in ('nshards', 'nmarkers', 'ntraits'):
+            if m[k] != first[k]:
+                raise ValueError("Shard %s disagrees on '%s'." % (fn, k))
+        if not allclose(m['null_lmls'], first['null_lmls'], rtol=1e-6):
+            raise ValueError("Shard %s has other null likelihoods: it comes "
+                             "from another scan." % fn)
+
+    shards = [m['shard'] for m in metas]
+    if len(set(shards)) != len(shards):
+        raise ValueError('Some shards are given more than once: %s.' %
+                         sorted(shards))
+    missing = sorted(set(range(first['nshards'])) - set(shards))
+    if missing:
+        raise ValueError('Shards %s are missing.' % missing)
+
+    tables = []
+    for (fn, m) in zip(filenames, metas):
+        df = read_csv(fn, sep='\t')
+        if len(df) != m['nrows']:
+            raise ValueError("Shard %s has %d rows instead of %d." %
+                             (fn, len(df), m['nrows']))
+        tables.append(df)
+
+    df = concat(tables, ignore_index=True)
+    df = df.sort_values(['trait', 'marker'], kind='mergesort')
+    df = df.reset_index(drop=True)
+
+    lambdas = []
+    for (_, d) in df.groupby('trait', sort=True):
+        calibration = CalibrationSummary()
+        lrs = 2 * (d['alt_lml'].values - d['null_lml'].values)
+        calibration.update(lrs[~d['monomorphic'].values.astype(bool)])
+        lambdas.append(calibration.genomic_control())
+
+    return (df, lambdas)
@@ -0,0 +1,108 @@
+from __future__ import division
+
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
+import pytest
+
+from lim.genetics import qtl
+from lim.genetics.phenotype import NormalPhenotype
+
+
+def test_qtl_scan_async():
+    if not hasattr(qtl, 'scan_async'):
+        pytest.skip('Coroutines need Python 3.6 or later.')
+
+    import asyncio
+
+    random = RandomState(0)
+    X = random.randn(100, 20)
+    G = random.randn(100, 30)
+    y = NormalPhenotype(random.randn(100))
+
+    a = qtl.scan(y, X, G=G, progress=False, options=dict(block_size=6))
+
+    loop = asyncio.new_event_loop()
+    try:
+        b = loop.run_until_complete(
+            qtl.scan_async(y, X, G=G, options=dict(block_size=6)))
+    finally:
+        loop.close()
+
+    assert_allclose(a.pvalues(), b.pvalues())
+
+
+def _setup(block_size):
+    random = RandomState(0)
+    X = random.randn(100, 20)
+    G = random.randn(100, 30)
+    y = NormalPhenotype(random.randn(100))
+    a = qtl.scan(y, X, G=G, progress=False,
+                 options=dict(block_size=block_size))
+    return (y, X, G, a)
+
+
+def test_qtl_scan_blocks():
+    if not hasattr(qtl, 'scan_blocks'):
+        pytest.skip('Coroutines need Python 3.6 or later.')
+
+    import asyncio
+
+    (y, X, G, a) = _setup(6)
+
+    async def collect():
+        b = await qtl.setup_scan_async(y, X, G=G, options=dict(block_size=6))
+        blocks = []
+        async for block in qtl.scan_blocks(b):
+            blocks.append(block)
+        return blocks
+
+    loop = asyncio.new_event_loop()
+    try:
+        blocks = loop.run_until_complete(collect())
+    finally:
+        loop.close()
+
+    assert_allclose([c.start for (c, _, _) in blocks], [0, 6, 12, 18])
+    for (cols, alt_lmls, effect_sizes) in blocks:
+        assert_allclose(alt_lmls, a.alt_lmls()[cols])
+        assert_allclose(effect_sizes, a.candidate_effect_sizes()[cols])
+
+
+def test_qtl_scan_blocks_cancel():
+    if not hasattr(qtl, 'scan_blocks'):
+        pytest.skip('Coroutines need Python 3.6 or later.')
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    (y, X, G, a) = _setup(6)
+    executor = ThreadPoolExecutor(1)
+
+    async def run(b, first):
+        async for _ in qtl.scan_blocks(b, executor):
+            first.set()
+
+    async def cancel():
+        b = await qtl.setup_scan_async(y, X, G=G, options=dict(block_size=6))
+        first = asyncio.Event()
+        task = asyncio.ensure_future(run(b, first))
+        await first.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return b
+
+    loop = asyncio.new_event_loop()
+    try:
+        b = loop.run_until_complete(cancel())
+    finally:
+        loop.close()
+    executor.shutdown(wait=True)
+
+    assert not b._valid_alt_models
+    assert_allclose(b.pvalues(), a.pvalues())
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
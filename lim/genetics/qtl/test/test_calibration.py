@@ -0,0 +1,66 @@
+from __future__ import division
+
+from numpy import array_split
+from numpy import inf
+from numpy import isfinite
+from numpy import mean
+from numpy import nan
+from numpy import median
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+from scipy.stats import chi2
+
+from lim.genetics.qtl import CalibrationSummary
+
+
+def test_calibration_summary():
+    stats = 1.5 * RandomState(0).chisquare(1, 20000)
+
+    c = CalibrationSummary()
+    d = CalibrationSummary()
+    for (i, s) in enumerate(array_split(stats, 10)):
+        (c if i % 2 == 0 else d).update(s)
+    c.merge(d)
+
+    assert_equal(c.count, len(stats))
+    lmbd = median(stats) / chi2(df=1).median()
+    assert_allclose(c.genomic_control(), lmbd, rtol=0.005)
+    assert_allclose(c.genomic_control(), 1.5, rtol=0.1)
+
+    (expected, observed) = c.qq()
+    assert_equal(len(expected), len(observed))
+    assert all(observed > expected * 0.5)
+
+    pv = c.corrected_pvalues(stats)
+    assert_allclose(median(pv), 0.5, atol=0.03)
+
+
+def test_calibration_summary_null_bias():
+    lambdas = []
+    for seed in range(6):
+        random = RandomState(seed)
+        c = CalibrationSummary()
+        for _ in range(100):
+            c.update(random.chisquare(1, 8192))
+        lambdas.append(c.genomic_control())
+
+    assert abs(mean(lambdas) - 1) < 0.005
+    assert_allclose(lambdas, 1, atol=0.01)
+
+
+def test_calibration_summary_nonfinite():
+    stats = RandomState(1).chisquare(1, 1001)
+
+    c = CalibrationSummary().update(stats)
+    d = CalibrationSummary().update(list(stats) + [nan, inf])
+
+    assert_equal(d.count, c.count)
+    assert_allclose(d.genomic_control(), c.genomic_control())
+    (expected, observed) = d.qq()
+    assert_allclose(observed, c.qq()[1])
+    assert_allclose(expected, c.qq()[0])
+    assert all(isfinite(observed))
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from numpy import save
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+from pandas import read_csv
+
+from lim.genetics.phenotype import NormalPhenotype
+from lim.genetics.qtl import scan
+from lim.genetics.qtl.cli import main
+
+
+def test_cli_scan():
+    random = RandomState(0)
+    X = random.randint(0, 3, (40, 7)).astype(float)
+    G = random.randn(40, 10)
+    y = random.randn(40)
+
+    folder = tempfile.mkdtemp()
+    try:
+        for (name, A) in [('X', X), ('G', G), ('y', y)]:
+            save(os.path.join(folder, name + '.npy'), A)
+
+        out = os.path.join(folder, 'out.tsv')
+        main([
+            '--phenotype', os.path.join(folder, 'y.npy'),
+            '--genotype', os.path.join(folder, 'X.npy'),
+            '--background', os.path.join(folder, 'G.npy'),
+            '--output', out, '--chunk-size', '3', '--workers', '2',
+            '--quiet'
+        ])
+        df = read_csv(out, sep='\t')
+    finally:
+        shutil.rmtree(folder)
+
+    lrt = scan(NormalPhenotype(y), X, G=G, progress=False)
+    assert_allclose(df['pvalue'], lrt.pvalues(), rtol=1e-5)
+    assert_allclose(df['effsize'], lrt.candidate_effect_sizes(), rtol=1e-5)
+
+
+def test_cli_save_background():
+    from lim.genetics.background import StoredBackground
+    from numpy import nan, stack
+
+    random = RandomState(1)
+    X = random.randint(0, 3, (40, 5)).astype(float)
+    G = random.randn(40, 10)
+    Y = random.randn(40, 3)
+    Y[3, 0] = nan
+    Y[[5, 8], 2] = nan
+
+    folder = tempfile.mkdtemp()
+    try:
+        for (name, A) in [('X', X), ('G', G), ('Y', Y)]:
+            save(os.path.join(folder, name + '.npy'), A)
+
+        bg = os.path.join(folder, 'bg.npz')
+        main([
+            '--phenotype', os.path.join(folder, 'Y.npy'),
+            '--background', os.path.join(folder, 'G.npy'),
+            '--save-background', bg, '--quiet'
+        ])
+        cache = StoredBackground(bg)
+        masks = stack([Y[:, t] == Y[:, t] for t in range(3)])
+        assert_allclose(cache.sample_masks, masks)
+        for mask in masks:
+            (Q0, _, S0) = cache.decomposition(mask)
+            assert_allclose(Q0.shape[0], mask.sum())
+
+        out = os.path.join(folder, 'out.tsv')
+        main([
+            '--phenotype', os.path.join(folder, 'Y.npy'),
+            '--genotype', os.path.join(folder, 'X.npy'),
+            '--background-file', bg, '--output', out, '--quiet'
+        ])
+        df = read_csv(out, sep='\t')
+    finally:
+        shutil.rmtree(folder)
+
+    ok = masks[2]
+    lrt = scan(NormalPhenotype(Y[ok, 2]), X[ok], G=G[ok], progress=False)
+    assert_allclose(df[df['trait'] == 2]['pvalue'], lrt.pvalues(), rtol=1e-5)
+
+
+def test_cli_update_background():
+    from lim.genetics.background import StoredBackground
+
+    random = RandomState(2)
+    G = random.randn(40, 10)
+    K = G.dot(G.T)
+
+    folder = tempfile.mkdtemp()
+    try:
+        save(os.path.join(folder, 'K0.npy'), K[:30, :30])
+        save(os.path.join(folder, 'K.npy'), K)
+        (old, new) = (os.path.join(folder, 'old.npz'),
+                      os.path.join(folder, 'new.npz'))
+        main([
+            '--kinship', os.path.join(folder, 'K0.npy'),
+            '--save-background', old, '--quiet'
+        ])
+        main([
+            '--background-file', old,
+            '--kinship', os.path.join(folder, 'K.npy'),
+            '--update-background', new, '--quiet'
+        ])
+        (Q0, Q1, S0) = StoredBackground(new).decomposition()
+        assert_allclose(Q0.shape[0], 40)
+        assert_allclose(Q0.shape[1] + Q1.shape[1], 40)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -0,0 +1,110 @@
+from __future__ import division
+
+from numpy import diag
+from numpy import eye
+from numpy import float32
+from numpy import hstack
+from numpy import isnan
+from numpy import log
+from numpy import ones
+from numpy import pi
+from numpy import sqrt
+from numpy.linalg import inv
+from numpy.linalg import slogdet
+from numpy.linalg import solve
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
+from numpy_sugar.linalg import economic_qs_linear
+
+from lim.genetics.qtl._fast import NormalScanKernel
+
+
+def _data():
+    random = RandomState(0)
+    (n, p) = (200, 100)
+    G = random.randn(n, 30) / sqrt(30)
+    ((Q0, _), S0) = economic_qs_linear(G)
+    M = hstack([ones((n, 1)), random.randn(n, 1)])
+    X = random.randn(n, p)
+    X = (X - X.mean(0)) / X.std(0) / sqrt(p)
+    y = random.randn(n)
+    return (y, M, X, Q0, S0)
+
+
+def test_normal_scan_kernel():
+    (y, M, X, Q0, S0) = _data()
+    n = len(y)
+    delta = 0.3
+
+    (lmls, effsizes) = NormalScanKernel(y, M, Q0, S0, delta).scan(X)
+
+    K = (1 - delta) * Q0.dot(diag(S0)).dot(Q0.T) + delta * eye(n)
+    Ki = inv(K)
+    logdet = slogdet(K)[1]
+    for j in range(3):
+        D = hstack([M, X[:, j:j + 1]])
+        beta = solve(D.T.dot(Ki).dot(D), D.T.dot(Ki).dot(y))
+        r = y - D.dot(beta)
+        scale = r.dot(Ki).dot(r) / n
+        lml = -n * log(2 * pi) - n - logdet - n * log(scale)
+        assert_allclose(lmls[j], lml / 2)
+        assert_allclose(effsizes[j], beta[-1])
+
+
+def test_normal_scan_kernel_statistics():
+    (y, M, X, Q0, S0) = _data()
+    n = len(y)
+    delta = 0.3
+
+    (_, effsizes, se, covariates) = NormalScanKernel(
+        y, M, Q0, S0, delta).statistics(X)
+
+    K = (1 - delta) * Q0.dot(diag(S0)).dot(Q0.T) + delta * eye(n)
+    Ki = inv(K)
+    for j in range(3):
+        D = hstack([M, X[:, j:j + 1]])
+        A = inv(D.T.dot(Ki).dot(D))
+        beta = A.dot(D.T.dot(Ki).dot(y))
+        r = y - D.dot(beta)
+        scale = r.dot(Ki).dot(r) / n
+        assert_allclose(effsizes[j], beta[-1])
+        assert_allclose(se[j], sqrt(scale * A[-1, -1]))
+        assert_allclose(covariates[:, j], beta[:-1])
+
+
+def test_normal_scan_kernel_covariate_span():
+    (y, M, X, Q0, S0) = _data()
+    n = len(y)
+    delta = 0.3
+
+    X = hstack([3 * M[:, 1:], X[:, :2]])
+    (lmls, effsizes, se, _) = NormalScanKernel(y, M, Q0, S0,
+                                               delta).statistics(X)
+
+    K = (1 - delta) * Q0.dot(diag(S0)).dot(Q0.T) + delta * eye(n)
+    Ki = inv(K)
+    beta = solve(M.T.dot(Ki).dot(M), M.T.dot(Ki).dot(y))
+    r = y - M.dot(beta)
+    scale = r.dot(Ki).dot(r) / n
+    null = -n * log(2 * pi) - n - slogdet(K)[1] - n * log(scale)
+
+    assert_allclose(lmls[0], null / 2)
+    assert_allclose(effsizes[0], 0)
+    assert isnan(se[0])
+    assert lmls[1] > null / 2
+
+
+def test_normal_scan_kernel_float32():
+    (y, M, X, Q0, S0) = _data()
+
+    for delta in [0.5, 0.05]:
+        (l64, e64) = NormalScanKernel(y, M, Q0, S0, delta).scan(X)
+        (l32, e32) = NormalScanKernel(y, M, Q0, S0, delta, float32).scan(
+            X.astype(float32))
+        assert_allclose(2 * l32, 2 * l64, rtol=0, atol=1e-4)
+        assert_allclose(e32, e64, rtol=1e-4, atol=1e-6)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -5,6 +5,7 @@ from numpy import dot, sqrt
 from numpy.random import RandomState
 from numpy.testing import assert_allclose
 
+from lim.genetics.background import BackgroundCache
 from lim.genetics.phenotype import (BernoulliPhenotype, BinomialPhenotype,
                                     NormalPhenotype, PoissonPhenotype)
 from lim.genetics.qtl import scan
@@ -204,5 +205,157 @@ def test_qtl_bernoulli_scan():
         rtol=1e-4)
 
 
+def test_qtl_normal_scan_missing():
+    random = RandomState(2)
+
+    N = 100
+    G = random.randn(N, N + 10)
+    X = random.randn(N, 3)
+    y = dot(G, random.randn(N + 10)) / sqrt(N + 10) + X[:, 1]
+
+    X[[1, 5, 7], 0] = np.nan
+    X[3, 2] = np.nan
+
+    Xi = X.copy()
+    for j in range(X.shape[1]):
+        Xi[np.isnan(X[:, j]), j] = np.nanmean(X[:, j])
+
+    qtl = scan(NormalPhenotype(y), X, G=G, progress=False,
+               options=dict(missing='impute'))
+    ref = scan(NormalPhenotype(y), Xi, G=G, progress=False)
+
+    assert_allclose(qtl.pvalues(), ref.pvalues(), rtol=1e-5)
+    assert_allclose(qtl.candidate_missing_rates(), [0.03, 0, 0.01])
+
+
+def test_qtl_normal_scan_sample_mask():
+    random = RandomState(2)
+
+    N = 100
+    G = random.randn(N, N + 10)
+    X = random.randn(N, 3)
+    y = dot(G, random.randn(N + 10)) / sqrt(N + 10) + X[:, 1]
+
+    mask = random.rand(N) < 0.7
+    pheno = NormalPhenotype(y[mask])
+    ref = scan(pheno, X[mask], G=G[mask], progress=False)
+
+    qtl = scan(pheno, X, G=G, progress=False, sample_mask=mask)
+    assert_allclose(qtl.pvalues(), ref.pvalues(), rtol=1e-5)
+
+    cache = BackgroundCache(G=G)
+    for _ in range(2):
+        qtl = scan(pheno, X, progress=False, sample_mask=mask, cache=cache)
+        assert_allclose(qtl.pvalues(), ref.pvalues(), rtol=1e-5)
+
+
+def test_qtl_binomial_scan_refine():
+    random = RandomState(9)
+
+    N = 100
+    G = random.randn(N, N + 10)
+    X = random.randn(N, 4)
+    ntrials = random.randint(1, 20, N)
+    nsuccesses = binomial(
+        ntrials, -0.1, G, causal_variants=X[:, :1], causal_variance=0.5,
+        random_state=random)
+    phenotype = BinomialPhenotype(nsuccesses, ntrials)
+
+    slow = scan(phenotype, X, G=G, progress=False, options=dict(fast=False))
+    qtl = scan(phenotype, X, G=G, progress=False,
+               options=dict(refine=0.5, block_size=3))
+
+    refined = qtl.refined_markers()
+    assert refined.any()
+    assert_allclose(qtl.pvalues()[refined], slow.pvalues()[refined],
+                    rtol=1e-5)
+
+    # The fast and exact binomial fits provide no standard errors.
+    assert np.isnan(qtl.candidate_effect_sizes_se()).all()
+    assert np.isnan(qtl.wald_statistics()).all()
+
+
+def test_qtl_normal_scan_dedup():
+    random = RandomState(3)
+
+    N = 60
+    G = random.randn(N, N + 10)
+    X = random.randint(0, 3, (N, 8)).astype(float)
+    X[:, 5] = X[:, 1]
+    X[:, 6] = 2
+    # Constant imputed dosage.
+    X[:, 3] = 0.7
+    y = dot(G, random.randn(N + 10)) / sqrt(N + 10) + X[:, 1]
+
+    qtl = scan(NormalPhenotype(y), X, G=G, progress=False,
+               options=dict(block_size=3))
+    full = scan(NormalPhenotype(y), X, G=G, progress=False,
+                options=dict(dedup=False))
+
+    assert_allclose(qtl.duplicate_markers(), [0, 1, 2, 3, 4, 1, 6, 7])
+    assert_allclose(qtl.monomorphic_markers(), [0, 0, 0, 1, 0, 0, 1, 0])
+    assert_allclose(qtl.pvalues()[[3, 6]], 1)
+    assert_allclose(qtl.candidate_effect_sizes()[[3, 6]], 0)
+
+    tested = [0, 1, 2, 4, 5, 7]
+    assert_allclose(qtl.pvalues()[tested], full.pvalues()[tested], rtol=1e-5)
+    assert_allclose(qtl.candidate_effect_sizes()[tested],
+                    full.candidate_effect_sizes()[tested], rtol=1e-5)
+
+
+def test_qtl_normal_scan_kernel():
+    from lim.genetics.qtl._qtl import _fast_scan
+    from scipy.stats import chi2
+
+    random = RandomState(4)
+
+    N = 100
+    G = random.randn(N, N + 20)
+    z = random.randn(N)
+    M = np.stack([np.ones(N), z], 1)
+    X = random.randn(N, 6)
+    X[:, 2] = 2 * z + 1
+    y = dot(G, random.randn(N + 20)) / sqrt(N + 20) + z + X[:, 0]
+
+    qtl = scan(NormalPhenotype(y), X, G=G, covariates=M, progress=False)
+
+    # The previous path: the limix fast scan of the fitted null model.
+    (alt, effsizes) = _fast_scan(qtl._method, qtl._covariates,
+                                 qtl.candidate_markers, False)
+    lrs = 2 * (alt - qtl.null_lml())
+    tested = [0, 1, 3, 4, 5]
+    assert_allclose(2 * (qtl.alt_lmls() - qtl.null_lml())[tested],
+                    lrs[tested], rtol=1e-4, atol=1e-6)
+    assert_allclose(qtl.pvalues()[tested], chi2(df=1).sf(lrs[tested]),
+                    rtol=1e-4, atol=1e-12)
+    assert_allclose(qtl.candidate_effect_sizes()[tested], effsizes[tested],
+                    rtol=1e-4)
+
+    # A candidate in the span of the covariates explains nothing more.
+    assert_allclose(qtl.alt_lmls()[2], qtl.null_lml())
+    assert_allclose(qtl.candidate_effect_sizes()[2], 0)
+    assert np.isnan(qtl.candidate_effect_sizes_se()[2])
+
+    se = qtl.candidate_effect_sizes_se()[tested]
+    assert np.all(se > 0)
+    assert_allclose(qtl.wald_statistics()[tested],
+                    (qtl.candidate_effect_sizes()[tested] / se)**2)
+
+
+def test_qtl_scan_options_unchanged():
+    from lim.genetics.qtl._scan import _setup_scan
+
+    random = RandomState(0)
+    G = random.randn(30, 40)
+    X = random.randn(30, 100)
+    y = random.randn(30)
+
+    options = dict(memory_limit=8 * 30 * (30 + 40 + 100) + 8 * 30 * 6 * 20)
+    qtl = _setup_scan(NormalPhenotype(y), X, G=G, progress=False,
+                      options=options)
+    assert qtl._options['block_size'] < 100
+    assert options == dict(memory_limit=options['memory_limit'])
+
+
 if __name__ == '__main__':
     __import__('pytest').main([__file__, '-s'])
@@ -0,0 +1,43 @@
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+
+from numpy import sqrt
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+
+from numpy_sugar.linalg import economic_qs_linear
+
+from lim.genetics.qtl import RotationCache
+from lim.tool.normalize import stdnorm
+
+
+def test_rotation_cache():
+    random = RandomState(0)
+    X = random.randint(0, 3, (20, 9)).astype(float)
+    ((Q0, _), S0) = economic_qs_linear(random.randn(20, 5))
+
+    folder = tempfile.mkdtemp()
+    try:
+        cache = RotationCache(folder, block_size=4)
+        (Y, Q0X, xx, missing) = cache.candidates(X, Q0, S0)
+
+        Z = stdnorm(X, 0) / sqrt(X.shape[1])
+        assert_allclose(Y, Z)
+        assert_allclose(Q0X, Q0.T.dot(Z))
+        assert_allclose(xx, (Z * Z).sum(0))
+        assert_equal(missing, 0)
+
+        RotationCache(folder, block_size=5).candidates(X, Q0, S0)
+        assert_equal(len(os.listdir(folder)), 1)
+
+        RotationCache(folder).candidates(X[:, 1:], Q0, S0)
+        assert_equal(len(os.listdir(folder)), 2)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
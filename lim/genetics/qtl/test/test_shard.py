@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+from pytest import raises
+
+from lim.genetics.background import StoredBackground
+from lim.genetics.background import save_decomposition
+from lim.genetics.phenotype import NormalPhenotype
+from lim.genetics.qtl import merge_shards
+from lim.genetics.qtl import scan
+from lim.genetics.qtl import write_shard
+from lim.genetics.qtl.shard import shard_range
+
+
+def test_shard_range():
+    cols = [shard_range('%d/3' % i, 10) for i in range(3)]
+    assert_equal([(c.start, c.stop) for c in cols], [(0, 3), (3, 6), (6, 10)])
+    with raises(ValueError):
+        shard_range('3/3', 10)
+
+
+def test_merge_shards():
+    random = RandomState(0)
+    X = random.randint(0, 3, (50, 7)).astype(float)
+    G = random.randn(50, 10)
+    y = random.randn(50)
+
+    folder = tempfile.mkdtemp()
+    try:
+        bg = os.path.join(folder, 'bg.npz')
+        save_decomposition(bg, G=G)
+        cache = StoredBackground(bg)
+
+        files = [os.path.join(folder, '%d.tsv' % i) for i in range(3)]
+        for (i, fn) in enumerate(files):
+            qtl = scan(NormalPhenotype(y), X, cache=cache, progress=False,
+                       options=dict(shard=(i, 3)))
+            write_shard(qtl, fn)
+
+        (df, _) = merge_shards(files)
+        with raises(ValueError):
+            merge_shards(files[:2])
+    finally:
+        shutil.rmtree(folder)
+
+    full = scan(NormalPhenotype(y), X, G=G, progress=False)
+    assert_equal(df['marker'], range(7))
+    assert_allclose(df['pvalue'], full.pvalues(), rtol=1e-5)
+    assert_allclose(df['effsize'], full.candidate_effect_sizes(), rtol=1e-5)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -7,5 +7,6 @@ def qtlscan_view(qtl):
     df = DataFrame({'chromid': ['unknown'] * n,
                     'position': [nan] * n,
                     'pvalue': qtl.pvalues(),
-                    'effsize': qtl.candidate_effect_sizes()})
+                    'effsize': qtl.candidate_effect_sizes(),
+                    'missing': qtl.candidate_missing_rates()})
     return df
@@ -0,0 +1,261 @@
+"""Resident scan service keeping the genetic background warm.
+
+A :class:`ScanServer` holds the genetic background of a cohort and its
+decompositions in memory, listens on a Unix socket or on a localhost port,
+and serves association scans and heritability estimations of submitted
+phenotypes with a pool of worker threads. :class:`ScanClient` submits the
+requests.
+
+Requests are unpickled by the server, so every connection must authenticate
+with the server's secret key: anyone holding it can run code in the server.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from numpy import asarray
+
+from .background import BackgroundCache
+from .heritability import estimate
+from .qtl import scan
+
+
+class ScanServer(object):
+    """Local server of scans against a fixed genetic background.
+
+    Args:
+        address: Socket path (str) or ``(host, port)`` tuple.
+        X (array_like): Candidate markers of the whole cohort.
+        G (array_like): Background markers of the whole cohort.
+        K (array_like): Kinship matrix of the whole cohort.
+        authkey (bytes): Shared secret required from clients. Defaults to a
+                         random key, available as :attr:`authkey`. It must
+                         be given explicitly to listen on a non-loopback
+                         address.
+        nworkers (int): Number of worker threads. Defaults to `2`.
+        maxsize (int): Number of sample masks whose decompositions are kept.
+                       Defaults to `8`.
+        rotation_cache (RotationCache): Cache of rotated candidate markers
+                                        shared by the scans.
+    """
+
+    def __init__(self, address, X, G=None, K=None, authkey=None, nworkers=2,
+                 maxsize=8, rotation_cache=None):
+        if authkey is None:
+            if not _is_loopback(address):
+                raise ValueError('Please, provide an authkey to listen on '
+                                 'the non-loopback address %s.' % (address, ))
+            authkey = os.urandom(32)
+
+        self._logger = logging.getLogger(__name__)
+        self._authkey = authkey
+        self._X = X
+        self._cache = BackgroundCache(G=G, K=K, maxsize=maxsize)
+        self._rotation_cache = rotation_cache
+        self._nworkers = nworkers
+        self._queue = Queue()
+        self._stop = Event()
+        # Clients can connect from now on; they wait until served.
+        self._listener = Listener(address, authkey=authkey)
+
+    @property
+    def address(self):
+        """Address the server listens on."""
+        return self._listener.address
+
+    @property
+    def authkey(self):
+        """Secret key the clients must provide."""
+        return self._authkey
+
+    def serve_forever(self):
+        """Decompose the background and serve requests until shutdown."""
+        self._cache.decomposition()
+        self._logger.info('Serving scans on %s.', self._listener.address)
+
+        workers = [
+            Thread(target=self._work) for _ in range(self._nworkers)
+        ]
+        for w in workers:
+            w.daemon = True
+            w.start()
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = self._listener.accept()
+                except AuthenticationError:
+                    self._logger.warning('Connection refused: wrong authkey.')
+                    continue
+                if self._stop.is_set():
+                    conn.close()
+                    break
+                t = Thread(target=self._read, args=(conn, ))
+                t.daemon = True
+                t.start()
+        finally:
+            for _ in workers:
+                self._queue.put(None)
+            self._listener.close()
+
+    def shutdown(self):
+        """Stop accepting connections and let the workers finish."""
+        self._stop.set()
+        try:
+            Client(self._listener.address, authkey=self._authkey).close()
+        except (IOError, OSError, EOFError):
+            pass
+
+    def _read(self, conn):
+        lock = Lock()
+        try:
+            while True:
+                request = conn.recv()
+                if request.get('op') == 'shutdown':
+                    self.shutdown()
+                    return
+                self._queue.put((conn, lock, request))
+        except (EOFError, IOError, OSError):
+            pass
+        finally:
+            # Workers may still be answering queued requests.
+            with lock:
+                conn.close()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            (conn, lock, request) = item
+            try:
+                response = dict(
+                    id=request.get('id'),
+                    status='ok',
+                    result=self._handle(request))
+            except Exception as e:
+                self._logger.exception('Request has failed.')
+                response = dict(
+                    id=request.get('id'), status='error', error=str(e))
+
+            try:
+                with lock:
+                    conn.send(response)
+            except (IOError, OSError):
+                pass
+
+    def _handle(self, request):
+        op = request.get('op')
+        mask = request.get('sample_mask')
+        covariates = request.get('covariates')
+
+        if op == 'scan':
+            lrt = scan(
+                request['phenotype'],
+                self._X,
+                covariates=covariates,
+                progress=False,
+                options=request.get('options'),
+                sample_mask=mask,
+                cache=self._cache,
+                rotation_cache=self._rotation_cache)
+            return dict(
+                pvalues=asarray(lrt.pvalues()),
+                effect_sizes=asarray(lrt.candidate_effect_sizes()),
+                effect_sizes_se=lrt.candidate_effect_sizes_se(),
+                null_lml=lrt.null_lml(),
+                alt_lmls=asarray(lrt.alt_lmls()))
+
+        if op == 'estimate':
+            return estimate(
+                request['phenotype'],
+                covariates=covariates,
+                overdispersion=request.get('overdispersion', True),
+                sample_mask=mask,
+                cache=self._cache)
+
+        if op == 'ping':
+            return 'pong'
+
+        raise ValueError('Unknown operation: %s.' % op)
+
+
+def _is_loopback(address):
+    if not isinstance(address, tuple):
+        # Unix socket or Windows named pipe.
+        return True
+    return address[0] in ('localhost', '127.0.0.1', '::1') or \
+        str(address[0]).startswith('127.')
+
+
+class ScanClient(object):
+    """Client of a :class:`ScanServer`.
+
+    Args:
+        address: Address of the server.
+        authkey (bytes): Secret key of the server (see
+                         :attr:`ScanServer.authkey`).
+    """
+
+    def __init__(self, address, authkey):
+        self._conn = Client(address, authkey=authkey)
+        self._nrequests = 0
+
+    def scan(self, phenotype, covariates=None, options=None,
+             sample_mask=None):
+        """Association scan of a phenotype.
+
+        Returns:
+            dict: `pvalues`, `effect_sizes`, `effect_sizes_se`, `null_lml`
+            and `alt_lmls`.
+        """
+        return self._request(
+            op='scan',
+            phenotype=phenotype,
+            covariates=covariates,
+            options=options,
+            sample_mask=sample_mask)
+
+    def estimate(self, phenotype, covariates=None, overdispersion=True,
+                 sample_mask=None):
+        """Heritability estimate of a phenotype."""
+        return self._request(
+            op='estimate',
+            phenotype=phenotype,
+            covariates=covariates,
+            overdispersion=overdispersion,
+            sample_mask=sample_mask)
+
+    def ping(self):
+        return self._request(op='ping')
+
+    def shutdown(self):
+        """Ask the server to stop and close the connection."""
+        self._conn.send(dict(op='shutdown'))
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _request(self, **request):
+        self._nrequests += 1
+        request['id'] = self._nrequests
+        self._conn.send(request)
+        response = self._conn.recv()
+        if response['status'] != 'ok':
+            raise RuntimeError(response['error'])
+        return response['result']
@@ -0,0 +1,168 @@
+from __future__ import division
+
+import os
+import pickle
+import shutil
+import tempfile
+
+from numpy import eye
+from numpy import hstack
+from numpy import ones
+from numpy import nan
+from numpy import sort
+from numpy import zeros
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+from scipy.sparse import csr_matrix
+
+from numpy_sugar.linalg import economic_qs
+
+from lim.genetics.background import BackgroundCache
+from lim.genetics.background import background_decomposition
+from lim.genetics.background import background_within_budget
+from lim.genetics.background import save_decomposition
+from lim.genetics.background import StoredBackground
+from lim.genetics.background import update_economic_qs
+
+
+def _pedigree_kinship(random, sizes):
+    n = sum(sizes)
+    K = zeros((n, n))
+    start = 0
+    for size in sizes:
+        G = random.randn(size, 2)
+        K[start:start + size, start:start + size] = G.dot(G.T)
+        start += size
+    idx = random.permutation(n)
+    return K[idx][:, idx]
+
+
+def test_sparse_background_decomposition():
+    K = _pedigree_kinship(RandomState(0), [3, 1, 4, 4, 2])
+
+    (Q0, Q1, S0) = background_decomposition(None, csr_matrix(K))
+    (R0, R1, T0) = background_decomposition(None, K.copy())
+
+    assert_equal(Q0.shape, R0.shape)
+    assert_equal(Q1.shape, R1.shape)
+    assert_allclose(sort(S0), sort(T0))
+    assert_allclose(Q0.dot(Q0.T * S0[:, None]), R0.dot(R0.T * T0[:, None]),
+                    atol=1e-10)
+    assert_allclose(Q1.T.dot(Q0), 0, atol=1e-10)
+
+
+def test_sparse_background_single_component():
+    K = _pedigree_kinship(RandomState(3), [30])
+    K += eye(30)
+
+    (Q0, Q1, S0) = background_decomposition(None, csr_matrix(K))
+    (R0, R1, T0) = background_decomposition(None, K.copy())
+
+    assert_equal(Q0.shape, R0.shape)
+    assert_equal(Q1.shape, R1.shape)
+    assert_allclose(sort(S0), sort(T0))
+    assert_allclose(Q0.dot(Q0.T * S0[:, None]), R0.dot(R0.T * T0[:, None]),
+                    atol=1e-10)
+
+
+def test_sparse_background_cache():
+    K = _pedigree_kinship(RandomState(1), [5, 3, 6])
+    mask = RandomState(2).rand(K.shape[0]) < 0.7
+
+    cache = BackgroundCache(K=csr_matrix(K))
+    (Q0, _, S0) = cache.decomposition(mask)
+    (R0, _, T0) = BackgroundCache(K=K).decomposition(mask)
+
+    assert_allclose(Q0.dot(Q0.T * S0[:, None]), R0.dot(R0.T * T0[:, None]),
+                    atol=1e-10)
+
+
+def test_background_within_budget():
+    random = RandomState(0)
+    G = random.randn(20, 50)
+    mask = random.rand(20) < 0.8
+
+    (H, K) = background_within_budget(G, None, mask, 2**20)
+    assert K is None
+    assert_equal(H.shape, (mask.sum(), 50))
+
+    (H, K) = background_within_budget(G, None, mask, 8 * 20 * 20 * 3)
+    assert H is None
+    assert_equal(K.shape, (mask.sum(), mask.sum()))
+
+    (_, _, S0) = background_decomposition(*background_within_budget(G, None))
+    (_, _, T0) = background_decomposition(
+        *background_within_budget(G, None, memory_limit=8 * 20 * 20 * 4))
+    assert_allclose(sort(S0 / S0.mean()), sort(T0 / T0.mean()))
+
+    # The fallback standardizes the markers over the masked samples and
+    # imputes them as the decomposition of the markers would.
+    G[mask.nonzero()[0][1], 2] = nan
+    for limit in [None, 8 * 20 * 20 * 3]:
+        (H, K) = background_within_budget(G, None, mask, limit, impute=True)
+        (Q0, _, S0) = background_decomposition(H, K, impute=True)
+        K = (Q0 * S0).dot(Q0.T)
+        if limit is None:
+            expected = K / K.diagonal().mean()
+    assert_allclose(K / K.diagonal().mean(), expected, atol=1e-10)
+
+
+def test_background_cache_pickle():
+    random = RandomState(0)
+    cache = BackgroundCache(G=random.randn(10, 4))
+    (Q0, _, S0) = cache.decomposition()
+
+    other = pickle.loads(pickle.dumps(cache))
+    (P0, _, T0) = other.decomposition()
+    assert_allclose(P0, Q0)
+    assert_allclose(T0, S0)
+    other.decomposition(random.rand(10) < 0.5)
+
+
+def test_update_economic_qs():
+    random = RandomState(1)
+    G = random.randn(60, 10)
+    K = G.dot(G.T)
+
+    ((Q0, Q1), S0) = economic_qs(K[:50, :50])
+    ((Q0, Q1, S0), error) = update_economic_qs((Q0, Q1, S0), K)
+    assert error < 1e-10
+    assert_equal(Q0.shape, (60, 10))
+    assert_equal(Q1.shape, (60, 50))
+    assert_allclose(Q0.dot(Q0.T * S0[:, None]), K, atol=1e-10)
+    assert_allclose(Q1.T.dot(Q0), 0, atol=1e-10)
+
+    ((Q0, Q1), S0) = economic_qs(K[:50, :50])
+    K[:50, :50] += eye(50)
+    ((_, _, S0), error) = update_economic_qs((Q0, Q1, S0), K)
+    assert error > 1e-6
+    assert_allclose(sort(S0), sort(economic_qs(K)[1]))
+
+
+def test_stored_background_update():
+    random = RandomState(2)
+    G = random.randn(60, 10)
+    K = G.dot(G.T)
+    mask = ones(50, bool)
+    mask[7] = False
+
+    folder = tempfile.mkdtemp()
+    try:
+        old = os.path.join(folder, 'old.npz')
+        save_decomposition(old, K=K[:50, :50], sample_mask=[ones(50, bool),
+                                                            mask])
+        new = StoredBackground(old).update(K, os.path.join(folder, 'new.npz'))
+
+        assert_equal(new.nsamples, 60)
+        for m in [ones(60, bool), hstack([mask, ones(10, bool)])]:
+            (Q0, Q1, S0) = new.decomposition(m)
+            (R0, _, T0) = background_decomposition(None, K[m][:, m].copy())
+            assert_allclose(Q0.dot(Q0.T * S0[:, None]),
+                            R0.dot(R0.T * T0[:, None]), atol=1e-8)
+            assert_equal(Q0.shape[1] + Q1.shape[1], m.sum())
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -0,0 +1,52 @@
+from __future__ import division
+
+from numpy import diff
+from numpy import isnan
+from numpy.random import RandomState
+from numpy.testing import assert_equal
+
+from lim.genetics.power import power_curves
+
+
+def test_power_curves():
+    random = RandomState(0)
+    X = random.randn(40, 6)
+    G = random.randn(40, 10)
+
+    r0 = power_curves(X, G, [0, 1], [0.5], [0.0, 0.2], 3, nprocs=1,
+                      chunk_size=2)
+    r1 = power_curves(X, G, [0, 1], [0.5], [0.0, 0.2], 3, nprocs=2,
+                      chunk_size=2)
+
+    assert_equal(list(r0['causal_variance']), [0.0, 0.2])
+    assert_equal(list(r0['power']), list(r1['power']))
+    assert all(r0['nreplicates'] <= 3)
+
+
+def test_power_curves_increase():
+    random = RandomState(1)
+    X = random.randn(100, 6)
+    G = random.randn(100, 20)
+
+    r = power_curves(X, G, [0, 1], [0.5], [0.0, 0.2, 0.45], 10, nprocs=1)
+
+    assert_equal(list(r['causal_variance']), [0.0, 0.2, 0.45])
+    assert all(diff(r['power'].values) >= 0)
+    assert r['power'].values[-1] > r['power'].values[0]
+
+
+def test_power_curves_degenerate():
+    random = RandomState(2)
+    X = random.randn(40, 6)
+    G = random.randn(40, 10)
+
+    # Such offsets make every outcome a case, or every count zero.
+    for (likelihood, offset) in [('bernoulli', 100), ('poisson', -100)]:
+        r = power_curves(X, G, [0, 1], [0.5], [0.0], 3, likelihood,
+                         offset=offset, nprocs=1)
+        assert_equal(list(r['nreplicates']), [0])
+        assert isnan(r['power'].values[0])
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
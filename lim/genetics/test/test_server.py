@@ -0,0 +1,59 @@
+import os
+import tempfile
+from multiprocessing import AuthenticationError
+from threading import Thread
+
+import pytest
+
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+from numpy.testing import assert_equal
+
+from lim.genetics.phenotype import NormalPhenotype
+from lim.genetics.qtl import scan
+from lim.genetics.server import ScanClient
+from lim.genetics.server import ScanServer
+
+
+def test_scan_server():
+    random = RandomState(0)
+    X = random.randn(50, 5)
+    G = random.randn(50, 10)
+    y = random.randn(50)
+
+    address = os.path.join(tempfile.mkdtemp(), 'lim.sock')
+    server = ScanServer(address, X, G=G, nworkers=1)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+
+    client = ScanClient(server.address, server.authkey)
+    try:
+        assert_equal(client.ping(), 'pong')
+        result = client.scan(NormalPhenotype(y))
+        lrt = scan(NormalPhenotype(y), X, G=G, progress=False)
+        assert_allclose(result['pvalues'], lrt.pvalues(), rtol=1e-5)
+    finally:
+        client.shutdown()
+        thread.join()
+
+
+def test_scan_server_authkey():
+    X = RandomState(0).randn(5, 2)
+    with pytest.raises(ValueError):
+        ScanServer(('0.0.0.0', 0), X, K=X.dot(X.T))
+
+    server = ScanServer(('127.0.0.1', 0), X, K=X.dot(X.T))
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with pytest.raises(AuthenticationError):
+            ScanClient(server.address, b'wrong')
+        client = ScanClient(server.address, server.authkey)
+        assert_equal(client.ping(), 'pong')
+    finally:
+        ScanClient(server.address, server.authkey).shutdown()
+        thread.join()
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -3,17 +3,25 @@ from __future__ import absolute_import
 from collections import OrderedDict
 
 import logging
+from multiprocessing import Pool
+from multiprocessing import cpu_count
 
 from tabulate import tabulate
 
 from numpy import asarray
+from numpy import full
+from numpy import inf
+from numpy import maximum
 from numpy import sqrt
 from numpy import ones
+from numpy.random import RandomState
 
 from numpy_sugar.linalg import economic_svd
 
 from ...tool.kinship import gower_normalization
 from ...tool.normalize import stdnorm
+from ...util.threads import blas_threads
+from ...util.threads import threads_per_process
 from limix_inference.lmm import SlowLMM
 from limix_inference.mean import LinearMean
 from limix_inference.cov import LinearCov
@@ -106,7 +114,36 @@ def preprocess(GK, covariates, input_info):
     input_info.effective_GK = GK
 
 
-def normal_decomposition(y, GK, covariates=None, progress=True):
+def normal_decomposition(y, GK, covariates=None, progress=True, nstarts=1,
+                         nprocs=None, random_state=None, nthreads=None):
+    """Variance decomposition of a Normal phenotype.
+
+    Args:
+        y          (array_like): Phenotype. Dimension (:math:`N\\times 0`).
+        GK         (array_like): Genetic markers or covariance matrices, one
+                                 for each variance component. Covariance
+                                 matrices are given as `(K, True)` tuples.
+        covariates (array_like): Covariates. Default is an offset.
+                                 Dimension (:math:`N\\times S`).
+        progress    (bool)     : Shows progress. Defaults to `True`.
+        nstarts     (int)      : Number of optimizations started from
+                                 different initial variance splits. The best
+                                 fit is kept. Defaults to `1`.
+        nprocs      (int)      : Number of processes used for the multi-start
+                                 optimization. Defaults to the number of
+                                 starts, bounded by the number of CPUs.
+        random_state (RandomState): Source of the random initial variance
+                                    splits. Defaults to `RandomState(0)`.
+        nthreads    (int)      : Maximum number of BLAS threads during the
+                                 call, per process. Defaults to no limit
+                                 for a single process, and to the number
+                                 of CPUs shared among the processes
+                                 otherwise.
+
+    Returns:
+        A :class:`NormalVarDec` instance. Its `candidates` attribute holds
+        every fit found, sorted by decreasing log marginal likelihood.
+    """
     logger = logging.getLogger(__name__)
     logger.info('Normal variance decomposition scan has started.')
     y = asarray(y, dtype=float)
@@ -120,7 +157,8 @@ def normal_decomposition(y, GK, covariates=None, progress=True):
     vd = NormalVarDec(
         y, ii.effective_GK, covariates=covariates, progress=progress)
 
-    vd.learn()
+    vd.learn(nstarts=nstarts, nprocs=nprocs, random_state=random_state,
+             nthreads=nthreads)
     # genetic_preprocess(X, G, K, covariates, ii)
     #
     # lrt = NormalLRT(y, ii.Q[0], ii.Q[1], ii.S[0], covariates=covariates,
@@ -135,6 +173,19 @@ def _offset_covariate(covariates, n):
     return ones((n, 1)) if covariates is None else covariates
 
 
+class VarDecFit(object):
+    def __init__(self, lml, scales, effsizes):
+        self.lml = lml
+        self.scales = scales
+        self.effsizes = effsizes
+
+    def __str__(self):
+        t = [['LML', self.lml]]
+        for (name, scale) in iter(self.scales.items()):
+            t.append(['Scale of %s' % name, scale])
+        return tabulate(t, tablefmt='plain')
+
+
 class VarDec(object):
     def __init__(self, K, covariates=None, progress=True):
         self._logger = logging.getLogger(__name__)
@@ -144,35 +195,157 @@ class VarDec(object):
         self._K = K
         n = list(K.items())[0][1][0].shape[0]
         self._covariates = _offset_covariate(covariates, n)
+        self.candidates = []
 
-    def learn(self):
+    @property
+    def best(self):
+        """Fit with the highest log marginal likelihood."""
+        if len(self.candidates) == 0:
+            return None
+        return self.candidates[0]
+
+    def learn(self, nstarts=1, nprocs=None, random_state=None,
+              nthreads=None):
         self._logger.info('Variance decomposition computation: has started.')
-        self._learn(progress=False)
+        if nstarts > 1:
+            self._multistart_learn(nstarts, nprocs, random_state, nthreads)
+        else:
+            with blas_threads(nthreads):
+                self._learn(progress=False)
 
 
-class NormalVarDec(VarDec):
-    def __init__(self, y, K, covariates=None, progress=True):
-        super(NormalVarDec, self).__init__(
-            K, covariates=covariates, progress=progress)
-        self._y = y
+def _normal_lmm(y, K, covariates):
+    mean = LinearMean(covariates.shape[1])
+    mean.set_data(covariates)
+
+    covs = []
+    for Ki in iter(K.items()):
+        c = LinearCov()
+        if Ki[1][1]:
+            G = economic_svd(Ki[1][0])
+        else:
+            G = Ki[1][0]
+
+        c.set_data((G, G))
+        covs.append(c)
+
+    cov = SumCov(covs)
+
+    return SlowLMM(y, mean, cov), mean, covs
 
-        mean = LinearMean(self._covariates.shape[1])
-        mean.set_data(self._covariates)
 
-        covs = []
-        for Ki in iter(K.items()):
-            c = LinearCov()
-            if Ki[1][1]:
-                G = economic_svd(Ki[1][0])
-            else:
-                G = Ki[1][0]
+def _initial_splits(total, ncomps, nstarts, random):
+    """Initial variances for each start.
 
-            c.set_data((G, G))
-            covs.append(c)
+    The first start splits the variance evenly, the following ones give most
+    of the variance to each component in turn, and the remaining ones are
+    drawn from a flat Dirichlet distribution.
+    """
+    splits = [full(ncomps, 1.0 / ncomps)]
+    if ncomps > 1:
+        for i in range(ncomps):
+            s = full(ncomps, 0.1 / (ncomps - 1))
+            s[i] = 0.9
+            splits.append(s)
 
-        cov = SumCov(covs)
+    while len(splits) < nstarts:
+        splits.append(random.dirichlet(ones(ncomps)))
 
-        self._lmm = SlowLMM(y, mean, cov)
+    return [total * maximum(s, 1e-4) for s in splits[:nstarts]]
+
+
+_shared = dict()
+
+
+def _init_worker(y, K, covariates, nthreads=None):
+    _shared['y'] = y
+    _shared['K'] = K
+    _shared['covariates'] = covariates
+    _shared['nthreads'] = nthreads
+
+
+def _fit_start(scales):
+    (lmm, mean, covs) = _normal_lmm(_shared['y'], _shared['K'],
+                                    _shared['covariates'])
+    for (c, s) in zip(covs, scales):
+        c.scale = s
+
+    try:
+        with blas_threads(_shared['nthreads']):
+            lmm.feed().maximize()
+    except Exception as e:
+        logging.getLogger(__name__).warning('Optimization failed: %s.', e)
+        return (-inf, scales, None)
+
+    return (lmm.feed().value(), [c.scale for c in covs],
+            asarray(mean.effsizes, float).copy())
+
+
+class NormalVarDec(VarDec):
+    def __init__(self, y, K, covariates=None, progress=True):
+        super(NormalVarDec, self).__init__(
+            K, covariates=covariates, progress=progress)
+        self._y = y
+        (self._lmm, self._mean, self._covs) = _normal_lmm(
+            y, K, self._covariates)
 
     def _learn(self, progress):
         self._lmm.feed().maximize()
+        self.candidates = [self._current_fit()]
+
+    def _current_fit(self):
+        scales = OrderedDict()
+        for (name, c) in zip(self._K.keys(), self._covs):
+            scales[name] = c.scale
+        return VarDecFit(self._lmm.feed().value(), scales,
+                         asarray(self._mean.effsizes, float).copy())
+
+    def _multistart_learn(self, nstarts, nprocs, random_state, nthreads):
+        if random_state is None:
+            random_state = RandomState(0)
+
+        starts = _initial_splits(self._y.var(), len(self._covs), nstarts,
+                                 random_state)
+
+        if nprocs is None:
+            nprocs = min(nstarts, cpu_count())
+
+        self._logger.info('Running %d optimizations over %d processes.',
+                          nstarts, nprocs)
+
+        # Workers receive the normalized background once via the pool
+        # initializer. Only under the fork start method do they share it
+        # without copying; under spawn or forkserver (the default on macOS
+        # and Windows) each worker gets its own pickled copy.
+        if nthreads is None and nprocs > 1:
+            nthreads = threads_per_process(nprocs)
+
+        initargs = (self._y, self._K, self._covariates, nthreads)
+        if nprocs > 1:
+            pool = Pool(nprocs, initializer=_init_worker, initargs=initargs)
+            try:
+                results = pool.map(_fit_start, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_worker(*initargs)
+            results = [_fit_start(s) for s in starts]
+            _shared.clear()
+
+        results = [r for r in results if r[2] is not None]
+        if len(results) == 0:
+            raise ValueError('All optimization starts have failed.')
+
+        results.sort(key=lambda r: r[0], reverse=True)
+
+        names = list(self._K.keys())
+        self.candidates = [
+            VarDecFit(lml, OrderedDict(zip(names, scales)), effsizes)
+            for (lml, scales, effsizes) in results
+        ]
+
+        (_, scales, effsizes) = results[0]
+        for (c, s) in zip(self._covs, scales):
+            c.scale = s
+        self._mean.effsizes = effsizes
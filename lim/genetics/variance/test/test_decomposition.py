@@ -0,0 +1,60 @@
+from __future__ import division
+
+from numpy import sqrt
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
+from lim.genetics.variance import normal_decomposition
+from lim.genetics.variance.decomposition import _normal_lmm
+from lim.genetics.variance.decomposition import normalize_covariance_list
+from lim.genetics.variance.decomposition import preprocess
+from lim.genetics.variance.decomposition import InputInfo
+
+
+def _data():
+    random = RandomState(5)
+    N = 40
+    G0 = random.randn(N, 20)
+    G1 = random.randn(N, 10)
+    y = G0.dot(random.randn(20)) / sqrt(20) + random.randn(N)
+    return (y, [G0, G1])
+
+
+def test_normal_decomposition_single_start():
+    (y, GK) = _data()
+
+    vd = normal_decomposition(y, GK, progress=False)
+
+    ii = InputInfo()
+    GK = normalize_covariance_list(GK)
+    preprocess(GK, None, ii)
+    (lmm, mean, covs) = _normal_lmm(y, ii.effective_GK, vd._covariates)
+    lmm.feed().maximize()
+
+    assert_allclose(vd.best.lml, lmm.feed().value(), rtol=1e-6)
+    assert_allclose(list(vd.best.scales.values()), [c.scale for c in covs],
+                    rtol=1e-4, atol=1e-6)
+    assert_allclose(vd.best.effsizes, mean.effsizes, rtol=1e-4, atol=1e-6)
+
+
+def test_normal_decomposition_multistart():
+    (y, GK) = _data()
+
+    fits = [
+        normal_decomposition(y, GK, progress=False, nstarts=5, nprocs=nprocs,
+                             random_state=RandomState(1))
+        for nprocs in [1, 2]
+    ]
+
+    for (a, b) in zip(fits[0].candidates, fits[1].candidates):
+        assert_allclose(a.lml, b.lml)
+        assert_allclose(list(a.scales.values()), list(b.scales.values()))
+        assert_allclose(a.effsizes, b.effsizes)
+
+    vd = fits[0]
+    assert len(vd.candidates) == 5
+    assert vd.best.lml == max(c.lml for c in vd.candidates)
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -1,3 +1,4 @@
 from .regression import RegGPSampler
 from .fastlmm import FastLMMSampler
 from .glmm import GLMMSampler
+from .lowrank import LowRankCov
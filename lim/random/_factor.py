@@ -0,0 +1,46 @@
+from __future__ import division
+
+from numpy import clip
+from numpy import finfo
+from numpy import inf
+from numpy import newaxis
+from numpy import sqrt
+from numpy.linalg import eigh
+from numpy.linalg import svd
+
+
+class NormalFactor(object):
+    """Square-root factor of a covariance matrix, computed once.
+
+    Draws reproduce :func:`numpy_sugar.random.multivariate_normal` for the
+    same random state: the singular value decomposition used by
+    :meth:`numpy.random.RandomState.multivariate_normal` up to a thousand
+    samples, and the clipped eigen decomposition above that. Each draw then
+    costs a single matrix-vector product.
+    """
+
+    def __init__(self, K):
+        self._svd = K.shape[0] <= 1000
+        if self._svd:
+            (_, s, v) = svd(K)
+            self._F = sqrt(s)[:, newaxis] * v
+        else:
+            (S, Q) = eigh(K)
+            S = clip(S, sqrt(finfo(float).eps), inf)
+            Q *= sqrt(S)
+            self._F = Q
+
+    def sample(self, m, random_state):
+        if self._svd:
+            u = random_state.standard_normal(len(m)).dot(self._F)
+            u += m
+            return u
+        return m + self._F.dot(random_state.randn(len(m)))
+
+
+def parameters_key(f):
+    """Hashable snapshot of the parameters of an optimix function."""
+    v = f.variables()
+    if len(v) == 0:
+        return b''
+    return v.flatten().tobytes()
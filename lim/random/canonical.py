@@ -1,6 +1,8 @@
 from numpy import sqrt
 from numpy import std
 from numpy import arange
+from numpy import asarray
+from numpy import newaxis
 from limix_inference.link import LogitLink
 from limix_inference.link import LogLink
 from limix_inference.lik import BernoulliLik
@@ -14,19 +16,21 @@ from limix_inference.cov import LinearCov
 from limix_inference.cov import SumCov
 from limix_inference.cov import EyeCov
 from .glmm import GLMMSampler
+from .lowrank import LowRankCov
 from ..tool.normalize import stdnorm
 
 
 def bernoulli(offset, G, heritability=0.5, causal_variants=None,
-              causal_variance=0, random_state=None):
+              causal_variance=0, random_state=None, lowrank=False,
+              nreplicates=None):
 
     link = LogitLink()
     mean, cov = _mean_cov(offset, G, heritability, causal_variants,
-                          causal_variance, random_state)
+                          causal_variance, random_state, lowrank)
     lik = BernoulliProdLik(link)
     sampler = GLMMSampler(lik, mean, cov)
 
-    return sampler.sample(random_state)
+    return sampler.sample(random_state, nreplicates)
 
 
 def binomial(ntrials,
@@ -35,27 +39,34 @@ def binomial(ntrials,
              heritability=0.5,
              causal_variants=None,
              causal_variance=0,
-             random_state=None):
+             random_state=None,
+             lowrank=False,
+             nreplicates=None):
 
     link = LogitLink()
     mean, cov = _mean_cov(offset, G, heritability, causal_variants,
-                          causal_variance, random_state)
+                          causal_variance, random_state, lowrank)
+    if nreplicates is not None:
+        ntrials = asarray(ntrials, float)
+        if ntrials.ndim == 1:
+            ntrials = ntrials[:, newaxis]
     lik = BinomialProdLik(ntrials, link)
     sampler = GLMMSampler(lik, mean, cov)
 
-    return sampler.sample(random_state)
+    return sampler.sample(random_state, nreplicates)
 
 
 def poisson(offset, G, heritability=0.5, causal_variants=None,
-            causal_variance=0, random_state=None):
+            causal_variance=0, random_state=None, lowrank=False,
+            nreplicates=None):
 
     mean, cov = _mean_cov(offset, G, heritability, causal_variants,
-                          causal_variance, random_state)
+                          causal_variance, random_state, lowrank)
     link = LogLink()
     lik = PoissonProdLik(link)
     sampler = GLMMSampler(lik, mean, cov)
 
-    return sampler.sample(random_state)
+    return sampler.sample(random_state, nreplicates)
 
 
 def _causal_mean(causal_variants, causal_variance, random):
@@ -76,7 +87,7 @@ def _causal_mean(causal_variants, causal_variance, random):
     return mean
 
 def _mean_cov(offset, G, heritability, causal_variants, causal_variance,
-              random_state):
+              random_state, lowrank=False):
     nsamples = G.shape[0]
     G = stdnorm(G, axis=0)
 
@@ -84,18 +95,24 @@ def _mean_cov(offset, G, heritability, causal_variants, causal_variance,
 
     mean1 = OffsetMean()
     mean1.offset = offset
-
-    cov1 = LinearCov()
-    cov2 = EyeCov()
-    cov = SumCov([cov1, cov2])
-
     mean1.set_data(nsamples, 'sample')
-    cov1.set_data((G, G), 'sample')
-    a = arange(nsamples)
-    cov2.set_data((a, a), 'sample')
 
-    cov1.scale = heritability - causal_variance
-    cov2.scale = 1 - heritability - causal_variance
+    # The low-rank path is much faster for large cohorts, but its draws
+    # differ from the dense ones for the same seed; it is thus opt-in.
+    if lowrank:
+        cov = LowRankCov(G, heritability - causal_variance,
+                         1 - heritability - causal_variance)
+    else:
+        cov1 = LinearCov()
+        cov2 = EyeCov()
+        cov = SumCov([cov1, cov2])
+
+        cov1.set_data((G, G), 'sample')
+        a = arange(nsamples)
+        cov2.set_data((a, a), 'sample')
+
+        cov1.scale = heritability - causal_variance
+        cov2.scale = 1 - heritability - causal_variance
 
     means = [mean1]
     if causal_variants is not None:
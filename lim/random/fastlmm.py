@@ -2,8 +2,8 @@ from numpy import full
 from numpy.random import RandomState
 
 from numpy_sugar.linalg import sum2diag
-from numpy_sugar.random import multivariate_normal
 
+from ._factor import NormalFactor
 from ..util.transformation import DesignMatrixTrans
 
 
@@ -15,11 +15,14 @@ class FastLMMSampler(object):
         self._cov = X.dot(X.T) * (1 - delta)
         sum2diag(self._cov, delta, out=self._cov)
         self._cov *= scale
+        self._factor = None
 
     def sample(self, random_state=None):
         if random_state is None:
             random_state = RandomState()
 
-        K = self._cov
-        o = full(K.shape[0], self._offset)
-        return multivariate_normal(o, K, random_state)
+        if self._factor is None:
+            self._factor = NormalFactor(self._cov)
+
+        o = full(self._cov.shape[0], self._offset)
+        return self._factor.sample(o, random_state)
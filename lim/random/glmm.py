@@ -1,10 +1,18 @@
 from __future__ import division
 
+from numpy import clip
+from numpy import finfo
+from numpy import inf
+from numpy import newaxis
+from numpy import sqrt
+from numpy.linalg import eigh
 from numpy.random import RandomState
 from numpy_sugar.linalg import sum2diag
 from numpy_sugar import epsilon
 from numpy_sugar.random import multivariate_normal
 
+from .lowrank import LowRankCov
+
 
 class GLMMSampler(object):
     def __init__(self, lik, mean, cov):
@@ -12,11 +20,25 @@ class GLMMSampler(object):
         self._mean = mean
         self._cov = cov
 
-    def sample(self, random_state=None):
+    def sample(self, random_state=None, nreplicates=None):
+        """Draw outcomes from the GLMM.
+
+        With `nreplicates`, the mean and covariance are evaluated once and an
+        :math:`N\\times R` matrix of independent outcomes is returned.
+        """
         if random_state is None:
             random_state = RandomState()
 
         m = self._mean.feed('sample').value()
+
+        if nreplicates is not None:
+            U = self._sample_latent(m, nreplicates, random_state)
+            return self._lik.sample(U, random_state)
+
+        if isinstance(self._cov, LowRankCov):
+            u = m + self._cov.sample(random_state)
+            return self._lik.sample(u, random_state)
+
         K = self._cov.feed('sample').value()
 
         sum2diag(K, +epsilon.small, out=K)
@@ -24,3 +46,16 @@ class GLMMSampler(object):
         sum2diag(K, -epsilon.small, out=K)
 
         return self._lik.sample(u, random_state)
+
+    def _sample_latent(self, m, nreplicates, random_state):
+        if isinstance(self._cov, LowRankCov):
+            U = self._cov.sample(random_state, nreplicates)
+        else:
+            K = self._cov.feed('sample').value()
+            (S, Q) = eigh(K)
+            S = clip(S, sqrt(finfo(float).eps), inf)
+            Q *= sqrt(S)
+            U = Q.dot(random_state.randn(len(m), nreplicates))
+
+        U += m[:, newaxis]
+        return U
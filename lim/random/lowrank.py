@@ -0,0 +1,44 @@
+from __future__ import division
+
+from numpy import sqrt
+
+from numpy_sugar.linalg import sum2diag
+
+
+class LowRankCov(object):
+    """Covariance matrix :math:`s\\mathrm G\\mathrm G^\\intercal + e\\mathrm I`.
+
+    Samples are drawn as
+    :math:`\\sqrt{s}\\mathrm G\\mathbf z_1 + \\sqrt{e}\\mathbf z_2`, which costs
+    :math:`O(NP)` and never forms the :math:`N\\times N` matrix.
+
+    Args:
+        G (array_like): Design matrix. Dimension (:math:`N\\times P`).
+        scale (float): Scale :math:`s` of the linear part.
+        noise (float): Scale :math:`e` of the identity part.
+    """
+
+    def __init__(self, G, scale, noise):
+        self.G = G
+        self.scale = scale
+        self.noise = noise
+
+    def value(self):
+        """Dense covariance matrix."""
+        K = self.G.dot(self.G.T)
+        K *= self.scale
+        sum2diag(K, self.noise, out=K)
+        return K
+
+    def sample(self, random_state, nreplicates=None):
+        """Zero-mean draw from the Normal distribution.
+
+        With `nreplicates`, returns an :math:`N\\times R` matrix of
+        independent draws computed with a single matrix product.
+        """
+        (n, p) = self.G.shape
+        shape = () if nreplicates is None else (nreplicates, )
+        u = self.G.dot(random_state.randn(*((p, ) + shape)))
+        u *= sqrt(self.scale)
+        u += sqrt(self.noise) * random_state.randn(*((n, ) + shape))
+        return u
@@ -1,16 +1,32 @@
 from numpy.random import RandomState
-from numpy_sugar.random import multivariate_normal
+
+from ._factor import NormalFactor
+from ._factor import parameters_key
 
 
 class RegGPSampler(object):
+    """Gaussian process sampler.
+
+    The mean vector and the covariance factorization are computed on first
+    use and kept until the parameters of `mean` or `cov` change.
+    """
+
     def __init__(self, mean, cov):
         self._mean = mean
         self._cov = cov
+        self._cache = dict(mean=(None, None), cov=(None, None))
 
     def sample(self, random_state=None):
         if random_state is None:
             random_state = RandomState()
 
-        m = self._mean.feed('sample').value()
-        K = self._cov.feed('sample').value()
-        return multivariate_normal(m, K, random_state)
+        m = self._cached('mean', lambda: self._mean.feed('sample').value())
+        F = self._cached(
+            'cov', lambda: NormalFactor(self._cov.feed('sample').value()))
+        return F.sample(m, random_state)
+
+    def _cached(self, name, compute):
+        key = parameters_key(getattr(self, '_' + name))
+        if self._cache[name][0] != key:
+            self._cache[name] = (key, compute())
+        return self._cache[name][1]
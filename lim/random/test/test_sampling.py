@@ -1,9 +1,14 @@
 from __future__ import division
 
+from numpy import cov
 from numpy.random import RandomState
-from numpy.testing import (assert_equal, assert_array_less)
+from numpy.testing import (assert_allclose, assert_equal, assert_array_less)
 
+from numpy_sugar.random import multivariate_normal
+
+from lim.random import FastLMMSampler
 from lim.random import GLMMSampler
+from lim.random import LowRankCov
 from lim.random.canonical import bernoulli
 from lim.random.canonical import binomial
 from lim.random.canonical import poisson
@@ -34,5 +39,44 @@ def test_canonical_poisson_sampler():
     assert_array_less(y, [20] * len(y))
 
 
+def test_lowrank_cov_sampler():
+    random = RandomState(9)
+    G = random.randn(4, 3)
+
+    c = LowRankCov(G, 0.7, 0.2)
+    U = [c.sample(random) for _ in range(20000)]
+    assert_allclose(cov(U, rowvar=False), c.value(), atol=0.1)
+
+    y = bernoulli(0.1, G, random_state=random, lowrank=True)
+    assert_array_less(y, [2] * 4)
+
+    y = poisson(0.1, G, random_state=random, lowrank=True)
+    assert_array_less(y, [20] * 4)
+
+
+def test_canonical_sampler_replicates():
+    random = RandomState(9)
+    G = random.randn(10, 5)
+
+    ntrials = [2, 3, 1, 1, 4, 5, 1, 2, 1, 1]
+    Y = binomial(ntrials, -0.1, G, random_state=random, nreplicates=7)
+    assert_equal(Y.shape, (10, 7))
+    assert_array_less(Y, [[i + 1] * 7 for i in ntrials])
+
+    Y = poisson(0.1, G, random_state=random, lowrank=True, nreplicates=3)
+    assert_equal(Y.shape, (10, 3))
+
+
+def test_fastlmm_sampler_cached_factor():
+    X = RandomState(0).randn(6, 3)
+    sampler = FastLMMSampler(0.5, 1.2, 0.3, X)
+
+    a = RandomState(1)
+    b = RandomState(1)
+    for _ in range(3):
+        y = sampler.sample(a)
+        assert_allclose(y, multivariate_normal(y * 0 + 0.5, sampler._cov, b))
+
+
 if __name__ == '__main__':
     __import__('pytest').main([__file__, '-s'])
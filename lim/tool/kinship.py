@@ -1,13 +1,142 @@
+from __future__ import division
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from numpy import array
+from numpy import asarray
 from numpy import copyto
+from numpy import isfinite
+from numpy import zeros
+from scipy.sparse import issparse
+
+from ..util import memory
+from .normalize import OnlineStandardizer
+
 
 def gower_normalization(K, out=None):
     """Perform Gower normalizion on covariance matrix K.
 
-    The rescaled covariance matrix has sample variance of 1.
+    The rescaled covariance matrix has sample variance of 1. Sparse matrices
+    from :mod:`scipy.sparse` are rescaled without being densified.
     """
-    c = (K.shape[0] - 1) / (K.trace() - K.mean(0).sum())
+    c = (K.shape[0] - 1) / (K.diagonal().sum() - K.sum() / K.shape[0])
     if out is None:
         return c * K
 
-    copyto(out, K)
+    if issparse(K):
+        if out is not K:
+            raise ValueError('Sparse matrices can only be normalized in place.')
+        K.data *= c
+        return
+
+    if out is not K:
+        copyto(out, K)
     out *= c
+
+
+def linear_kinship(G, block_size=None, nthreads=None, gower=True, out=None,
+                   memory_limit=None, sample_mask=None, impute=False):
+    """Kinship matrix from genetic markers, computed block by block.
+
+    Each block of markers is read, restricted to the masked samples,
+    converted to float and standardized on its own, and its contribution
+    to :math:`\\mathrm G\\mathrm G^\\intercal` is accumulated over row
+    tiles of the upper triangle in parallel threads. Only one block of
+    markers is held in memory at a time.
+
+    Packed genotypes (e.g., two bits per call) are not decoded here: they
+    are read through any object whose slices return the decoded calls.
+
+    Args:
+        G (array_like): Genetic markers. Any object with a `shape` attribute
+                        and supporting two-dimensional slicing (e.g.,
+                        :class:`numpy.memmap` or :class:`h5py.Dataset`).
+                        Dimension (:math:`N\\times P_b`).
+        block_size (int): Number of markers per block. Defaults to `1024`,
+                          or to the largest block within `memory_limit`.
+        nthreads (int): Number of threads. Defaults to the number of CPUs.
+        gower (bool): Applies Gower normalization. Defaults to `True`.
+        out (array_like): Optional output array (:math:`N\\times N`).
+        memory_limit (int or str): Memory budget for the kinship matrix and
+                                   the blocks being read and multiplied
+                                   (e.g., ``'2GB'``).
+        sample_mask (array_like): Samples to keep, over which markers are
+                                  standardized. Defaults to all.
+        impute (bool): Mean-imputes non-finite entries of `G`. Defaults to
+                       `False`.
+
+    Returns:
+        The kinship matrix of the masked samples.
+    """
+    p = G.shape[1]
+    if sample_mask is None:
+        n = G.shape[0]
+    else:
+        sample_mask = asarray(sample_mask, bool)
+        n = int(sample_mask.sum())
+
+    if nthreads is None:
+        nthreads = cpu_count()
+
+    if memory_limit is not None:
+        # The kinship matrix, plus the block being multiplied, the one being
+        # read ahead and the standardization temporaries.
+        size = memory.block_size(memory_limit, 8 * n * n, 3 * 8 * G.shape[0],
+                                 p)
+        block_size = size if block_size is None else min(block_size, size)
+    elif block_size is None:
+        block_size = 1024
+
+    if out is None:
+        out = zeros((n, n))
+    else:
+        out[:] = 0
+
+    if n == 0:
+        return out
+
+    tile = -(-n // nthreads)
+    rows = [slice(i, min(i + tile, n)) for i in range(0, n, tile)]
+    tiles = [(r0, r1) for (i, r0) in enumerate(rows) for r1 in rows[i:]]
+
+    def read(j):
+        B = asarray(G[:, j:j + block_size])
+        if sample_mask is not None:
+            B = B[sample_mask]
+        # A float copy, standardized in place.
+        B = array(B, dtype=float, order='C')
+        if not impute and not isfinite(B).all():
+            raise ValueError(
+                "The genetic markers matrix G has non-finite values.")
+        st = OnlineStandardizer(B.shape[1], impute).partial_fit(B)
+        return st.transform(B, out=B)
+
+    def accumulate(B, r0, r1):
+        out[r0, r1] += B[r0].dot(B[r1].T)
+
+    pool = ThreadPool(nthreads)
+    try:
+        nxt = pool.apply_async(read, (0, ))
+        for j in range(0, p, block_size):
+            B = nxt.get()
+            if j + block_size < p:
+                nxt = pool.apply_async(read, (j + block_size, ))
+            tasks = [pool.apply_async(accumulate, (B, r0, r1))
+                     for (r0, r1) in tiles]
+            for t in tasks:
+                t.get()
+    finally:
+        pool.close()
+        pool.join()
+
+    for (r0, r1) in tiles:
+        if r0 != r1:
+            out[r1, r0] = out[r0, r1].T
+
+    out /= p
+
+    if gower:
+        gower_normalization(out, out=out)
+
+    return out
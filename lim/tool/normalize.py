@@ -1,22 +1,217 @@
 from __future__ import division
 
+from multiprocessing.pool import ThreadPool
+
+from numpy import array_split
 from numpy import ascontiguousarray
+from numpy import asarray
+from numpy import copyto
+from numpy import einsum
+from numpy import finfo
+from numpy import isfinite
+from numpy import may_share_memory
+from numpy import maximum
+from numpy import newaxis
+from numpy import sqrt
+from numpy import where
+from numpy import zeros
+
+# Number of entries of the centred temporary used by partial_fit.
+_CHUNK_SIZE = 2**20
+
+# Standard deviation, relative to the mean, below which a column is deemed
+# constant: a few rounding errors of the mean.
+_CONSTANT_TOL = 100 * finfo(float).eps
+
+
+class OnlineStandardizer(object):
+    """Mergeable column-wise mean and standard deviation.
+
+    Statistics are accumulated with the pairwise updates of Chan et al., so
+    blocks of rows can be fitted in any order, in separate threads, and merged
+    afterwards. A block may cover only some of the columns, given by its
+    starting column.
+
+    With `skipna`, non-finite entries are left out of the statistics and
+    counted as missing, and :meth:`transform` imputes them with the column
+    mean (i.e., zero after standardization).
+
+    Args:
+        ncols (int): Number of columns.
+        skipna (bool): Treats non-finite entries as missing. Defaults to
+                       `False`.
+    """
+
+    def __init__(self, ncols, skipna=False):
+        self.count = zeros(ncols)
+        self.mean = zeros(ncols)
+        self.nmissing = zeros(ncols)
+        self.skipna = skipna
+        self._m2 = zeros(ncols)
+
+    @property
+    def var(self):
+        """Column variances."""
+        return self._m2 / maximum(self.count, 1)
+
+    @property
+    def std(self):
+        """Column standard deviations."""
+        return sqrt(self.var)
+
+    @property
+    def constant(self):
+        """Columns without variation, up to rounding errors.
+
+        A constant column of non-integer values can have a tiny positive
+        standard deviation made of rounding errors, so a column is deemed
+        constant when its standard deviation is zero or within a few
+        rounding errors of its mean. Columns of small values with small
+        variations are not constant.
+        """
+        std = self.std
+        return (std == 0) | (std <= _CONSTANT_TOL * abs(self.mean))
+
+    @property
+    def missing_rate(self):
+        """Fraction of missing entries per column."""
+        return self.nmissing / maximum(self.count + self.nmissing, 1)
+
+    def partial_fit(self, X, start=0):
+        """Update the statistics with a block of rows.
+
+        Args:
+            X (array_like): Block whose columns are the columns
+                            `start, ..., start + X.shape[1] - 1`.
+            start (int): First column of the block. Defaults to `0`.
+        """
+        X = asarray(X)
+        if X.ndim == 1:
+            X = X[:, newaxis]
+
+        if X.shape[0] == 0:
+            return self
+
+        # Columns are centred a chunk at a time, so the temporary stays small
+        # whatever the size of the block.
+        step = max(1, _CHUNK_SIZE // X.shape[0])
+        for j in range(0, X.shape[1], step):
+            self._fit_columns(X[:, j:j + step], start + j)
+        return self
+
+    def _fit_columns(self, X, start):
+        cols = slice(start, start + X.shape[1])
+
+        if self.skipna:
+            ok = isfinite(X)
+            nb = ok.sum(0)
+            d = where(ok, X, 0).astype(float)
+            m = d.sum(0) / maximum(nb, 1)
+            d -= m
+            d[~ok] = 0
+            self.nmissing[cols] += X.shape[0] - nb
+            self._update(cols, nb, m, einsum('ij,ij->j', d, d))
+            return
+
+        m = X.mean(0, dtype=float)
+        d = X - m
+        self._update(cols, X.shape[0], m, einsum('ij,ij->j', d, d))
+
+    def fit(self, X, nthreads=1):
+        """Fit all rows of X, split in chunks among threads."""
+        X = asarray(X)
+        if X.ndim == 1:
+            X = X[:, newaxis]
+
+        if nthreads <= 1 or X.shape[0] < 2 * nthreads:
+            return self.partial_fit(X)
+
+        def fit_chunk(C):
+            return OnlineStandardizer(X.shape[1], self.skipna).partial_fit(C)
+
+        pool = ThreadPool(nthreads)
+        try:
+            parts = pool.map(fit_chunk, array_split(X, nthreads))
+        finally:
+            pool.close()
+            pool.join()
+
+        for p in parts:
+            self.merge(p)
+
+        return self
+
+    def merge(self, other, start=0):
+        """Merge the statistics of another standardizer."""
+        cols = slice(start, start + len(other.count))
+        self._update(cols, other.count, other.mean, other._m2)
+        self.nmissing[cols] += other.nmissing
+        return self
+
+    def _update(self, cols, nb, mb, m2b):
+        na = self.count[cols]
+        n = na + nb
+        w = nb / maximum(n, 1)
+        delta = mb - self.mean[cols]
+        self.mean[cols] += delta * w
+        self._m2[cols] += m2b + delta * delta * (na * w)
+        self.count[cols] = n
+
+    def transform(self, X, start=0, out=None):
+        """Standardize a block of columns.
+
+        Constant columns (see :attr:`constant`) are set to zero. Pass
+        `out=X` to standardize in place.
+        """
+        if out is None:
+            out = _float_copy(X)
+        elif out is not X:
+            copyto(out, X)
+
+        cols = slice(start, start + (out.shape[1] if out.ndim > 1 else 1))
+        c = self.constant[cols]
+        out -= self.mean[cols]
+        out /= where(c, 1, self.std[cols])
+        out *= ~c
+        if self.skipna:
+            out[~isfinite(out)] = 0
+        return out
+
+
+def _float_copy(X):
+    X = asarray(X)
+    if X.dtype.kind == 'f':
+        return X.copy()
+    return X.astype(float)
+
 
 def stdnorm(X, axis=None, out=None):
     X = ascontiguousarray(X)
     if out is None:
-        out = X.copy()
+        out = _float_copy(X)
+    elif out is not X:
+        copyto(out, X)
 
-    m = out.mean(axis)
-    s = out.std(axis)
-    ok = s > 0
+    if out.ndim == 1 or axis is None:
+        V = out.reshape((-1, 1))
+    elif out.ndim == 2:
+        V = out if axis == 0 else out.T
+    else:
+        return _stdnorm_nd(out, axis)
 
-    out -= m
+    st = OnlineStandardizer(V.shape[1]).partial_fit(V)
+    st.transform(V, out=V)
 
-    if out.ndim == 1:
-        if s > 0:
-            out /= s
-    else:
-        out[..., ok] /= s[ok]
+    # Reshaping a non-contiguous `out` makes a copy.
+    if not may_share_memory(V, out):
+        out[...] = V.reshape(out.shape)
+
+    return out
 
+
+def _stdnorm_nd(out, axis):
+    m = out.mean(axis, keepdims=True)
+    s = out.std(axis, keepdims=True)
+    out -= m
+    out /= where(s > 0, s, 1)
     return out
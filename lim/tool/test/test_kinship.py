@@ -0,0 +1,68 @@
+from numpy import isfinite, nan, nanmean, nanstd, sqrt, zeros
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+from pytest import raises
+from scipy.sparse import csr_matrix
+
+from lim.tool.kinship import gower_normalization, linear_kinship
+from lim.tool.normalize import stdnorm
+
+
+def test_linear_kinship():
+    random = RandomState(0)
+    G = random.randint(0, 3, size=(31, 103)).astype('int8')
+
+    S = stdnorm(G.astype(float), 0)
+    S /= sqrt(S.shape[1])
+    K = gower_normalization(S.dot(S.T))
+
+    assert_allclose(linear_kinship(G, block_size=10, nthreads=3), K)
+    assert_allclose(linear_kinship(G, block_size=200, nthreads=1), K)
+    assert_allclose(
+        linear_kinship(G, block_size=7, nthreads=4, gower=False),
+        S.dot(S.T))
+
+    n = G.shape[0]
+    assert_allclose(linear_kinship(G, memory_limit=8 * n * (n + 3 * 5)), K)
+    with raises(MemoryError):
+        linear_kinship(G, memory_limit=8 * n * n)
+
+
+def test_linear_kinship_mask_impute():
+    random = RandomState(1)
+    G = random.randint(0, 3, size=(31, 53)).astype(float)
+    mask = random.rand(31) < 0.7
+
+    S = stdnorm(G[mask], 0)
+    K = gower_normalization(S.dot(S.T))
+    assert_allclose(
+        linear_kinship(G, block_size=10, nthreads=2, sample_mask=mask), K)
+
+    H = G.copy()
+    H[3, 5] = nan
+    H[mask.nonzero()[0][0], 7] = nan
+    S = (H[mask] - nanmean(H[mask], 0)) / nanstd(H[mask], 0)
+    S[~isfinite(S)] = 0
+    K = gower_normalization(S.dot(S.T))
+    assert_allclose(
+        linear_kinship(H, block_size=10, sample_mask=mask, impute=True), K)
+    with raises(ValueError):
+        linear_kinship(H, block_size=10)
+
+    assert linear_kinship(G, sample_mask=zeros(31, bool)).shape == (0, 0)
+
+
+def test_sparse_gower_normalization():
+    random = RandomState(0)
+    G = random.randn(10, 3)
+    K = G.dot(G.T)
+    K[:5, 5:] = 0
+    K[5:, :5] = 0
+
+    S = csr_matrix(K)
+    gower_normalization(S, out=S)
+    assert_allclose(S.toarray(), gower_normalization(K))
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -1,8 +1,10 @@
-from numpy import ones
+from __future__ import division
+
+from numpy import float32, nan, nanmean, nanstd, ones, zeros
 from numpy.random import RandomState
 from numpy.testing import assert_allclose
 
-from lim.tool.normalize import stdnorm
+from lim.tool.normalize import OnlineStandardizer, stdnorm
 
 
 def test_stdnorm():
@@ -25,5 +27,89 @@ def test_stdnorm():
     assert_allclose(stdnorm(x).mean(0), [0])
     assert_allclose(stdnorm(x).std(0), [0])
 
+    X = random.randn(6, 4)
+    out = zeros((4, 6)).T
+    stdnorm(X, out=out)
+    assert_allclose(out.mean(), 0, atol=1e-12)
+    assert_allclose(out.std(), 1)
+    assert_allclose(out, (X - X.mean()) / X.std())
+
+
+def test_online_standardizer():
+    random = RandomState(38943)
+    X = random.randn(23, 7)
+    X[:, 3] = 2
+
+    st = OnlineStandardizer(7)
+    st.partial_fit(X[:10, :4])
+    st.partial_fit(X[:10, 4:], start=4)
+
+    other = OnlineStandardizer(7).partial_fit(X[10:15])
+    other.partial_fit(X[15:])
+    st.merge(other)
+
+    assert_allclose(st.mean, X.mean(0))
+    assert_allclose(st.std, X.std(0), atol=1e-12)
+    assert_allclose(
+        OnlineStandardizer(7).fit(X, nthreads=3).std, X.std(0), atol=1e-12)
+
+    import lim.tool.normalize as normalize
+    size = normalize._CHUNK_SIZE
+    normalize._CHUNK_SIZE = 23 * 2
+    try:
+        chunked = OnlineStandardizer(7).partial_fit(X)
+    finally:
+        normalize._CHUNK_SIZE = size
+    assert_allclose(chunked.mean, X.mean(0))
+    assert_allclose(chunked.std, X.std(0), atol=1e-12)
+
+    st32 = OnlineStandardizer(7).partial_fit(X.astype(float32))
+    assert_allclose(st32.std, X.astype(float32).std(0, dtype=float),
+                    atol=1e-12)
+
+    Y = X.copy()
+    st.transform(Y[:, 2:5], start=2, out=Y[:, 2:5])
+    assert_allclose(Y[:, 2:5], stdnorm(X, 0)[:, 2:5], atol=1e-12)
+    assert_allclose(Y[:, 3], 0)
+
+
+def test_online_standardizer_constant():
+    for (v, n) in [(0.1, 50), (0.3, 200), (0.7, 1000), (1.1, 77), (0.05, 500)]:
+        X = ones((n, 2)) * v
+        X[::2, 1] = 0
+        st = OnlineStandardizer(2).partial_fit(X)
+        assert_allclose(st.constant, [True, False])
+        assert_allclose(st.transform(X)[:, 0], 0, atol=0)
+        assert_allclose(st.transform(X)[:, 1].std(), 1)
+
+
+def test_stdnorm_small_variations():
+    random = RandomState(5)
+    for X in [random.randn(100, 3) * 1e-9, random.randn(100) * 1e-10,
+              1e6 + random.randn(100, 2) * 1e-3]:
+        Y = stdnorm(X, 0)
+        assert_allclose(Y.std(0), 1)
+        assert_allclose(Y.mean(0), 0, atol=1e-6)
+
+
+def test_online_standardizer_missing():
+    random = RandomState(38943)
+    X = random.randn(12, 3)
+    X[[1, 4], 0] = nan
+    X[7, 2] = nan
+
+    st = OnlineStandardizer(3, skipna=True)
+    st.partial_fit(X[:6]).partial_fit(X[6:])
+
+    assert_allclose(st.mean, nanmean(X, 0))
+    assert_allclose(st.std, nanstd(X, 0))
+    assert_allclose(st.missing_rate, [2 / 12, 0, 1 / 12])
+
+    Y = st.transform(X)
+    assert_allclose(Y[[1, 4], 0], 0)
+    assert_allclose(Y[7, 2], 0)
+    assert_allclose(Y[0], (X[0] - nanmean(X, 0)) / nanstd(X, 0))
+
+
 if __name__ == '__main__':
     __import__('pytest').main([__file__, '-s'])
@@ -1,6 +1,7 @@
 from . import fruits
 
 from .quantile_summary import quantile_summary
+from .sketch import QuantileSketch
 
 from .type import npy2py_type
 from .type import npy2py_cast
@@ -8,3 +9,5 @@ from .six import unicode_compatible
 from .transformation import DesignMatrixTrans
 from . import symbol
 from . import preprocess
+from .threads import blas_threads
+from . import memory
@@ -0,0 +1,107 @@
+from __future__ import absolute_import, division
+
+import re
+import sys
+
+from six import string_types
+
+_UNITS = {
+    '': 1,
+    'k': 1024,
+    'm': 1024**2,
+    'g': 1024**3,
+    't': 1024**4,
+}
+
+
+def parse_memory(limit):
+    """Number of bytes of a memory size.
+
+    Args:
+        limit (int, float or str): Bytes, or a string such as ``'512MB'``,
+                                   ``'4G'`` or ``'1.5GiB'``. Units are
+                                   powers of 1024.
+
+    Returns:
+        int: Number of bytes.
+    """
+    if not isinstance(limit, string_types):
+        return int(limit)
+
+    m = re.match(r'^\s*([0-9.]+)\s*([kmgt]?)(i?b)?\s*$', limit.lower())
+    if m is None:
+        raise ValueError("Invalid memory size: '%s'." % limit)
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def format_memory(nbytes):
+    """Human-readable memory size."""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024:
+            return '%.1f %s' % (nbytes, unit)
+        nbytes /= 1024
+    return '%.1f TB' % nbytes
+
+
+def block_size(memory_limit, fixed, per_column, maximum=None):
+    """Largest number of columns processed at a time within a budget.
+
+    Args:
+        memory_limit (int or str): Memory budget (see :func:`parse_memory`).
+        fixed (int): Bytes needed regardless of the block size.
+        per_column (int): Bytes needed per column of a block.
+        maximum (int): Upper bound of the block size.
+
+    Returns:
+        int: Block size.
+    """
+    limit = parse_memory(memory_limit)
+    size = (limit - fixed) // max(per_column, 1)
+    if size < 1:
+        raise MemoryError(
+            'The memory limit of %s is too small: at least %s are needed.' %
+            (format_memory(limit), format_memory(fixed + per_column)))
+    if maximum is not None:
+        size = min(size, max(maximum, 1))
+    return int(size)
+
+
+def peak_memory():
+    """Peak resident memory of the process in bytes.
+
+    It is the maximum over the whole life of the process, not only the
+    last call. Returns ``None`` where the :mod:`resource` module is not
+    available (e.g., Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def log_peak_memory(logger, memory_limit=None, start=None):
+    """Log the process peak memory after a call.
+
+    The peak is over the whole process (see :func:`peak_memory`). A warning
+    is only issued when the call itself raised it above the budget, that is,
+    when it is above both `memory_limit` and `start`, the peak measured at
+    the beginning of the call.
+    """
+    peak = peak_memory()
+    if peak is None:
+        return
+
+    reached = start is None or peak > start
+    if reached and memory_limit is not None and \
+            peak > parse_memory(memory_limit):
+        logger.warning('Process peak memory of %s exceeded the limit of %s.',
+                       format_memory(peak),
+                       format_memory(parse_memory(memory_limit)))
+    else:
+        logger.info('Process peak memory: %s.', format_memory(peak))
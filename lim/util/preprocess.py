@@ -1,25 +1,84 @@
 from __future__ import division
 from __future__ import absolute_import
 
-from numpy import empty_like
+from multiprocessing.pool import ThreadPool
+
+from numpy import arange
+from numpy import argsort
+from numpy import array_split
+from numpy import asarray
+from numpy import concatenate
+from numpy import empty
+from numpy import inf
 from numpy import isfinite
+from numpy import maximum
+from numpy import minimum
+from numpy import newaxis
+from numpy import where
 
-from scipy.stats import rankdata
 from scipy.stats import norm
 
-def quantile_gaussianize(x):
-    ok = isfinite(x)
-    x[ok] *= -1
-    y = empty_like(x)
-    y[ok] = rankdata(x[ok])
-    y[ok] = norm.isf(y[ok] / (sum(ok) + 1))
-    y[~ok] = x[~ok]
-    return y
-
-if __name__ == '__main__':
-    import numpy as np
-    np.set_printoptions(precision=12)
-    x = np.array([np.nan, 2.1, 2.4, -100.2, 2.2, 1.0, 0.0, 2.1])
-    print(x)
-    y = quantile_gaussianize(x)
-    print(y)
+
+def quantile_gaussianize(x, axis=0, nthreads=1):
+    """Normalize values via rank and Normal c.d.f.
+
+    Each column (for `axis=0`) or row (for `axis=1`) is replaced by the
+    Normal quantiles of its ranks divided by the number of finite values
+    plus one. Ties get their average rank. Non-finite values are left out of
+    the ranking and kept as they are. The input is not modified.
+
+    Args:
+        x (array_like): Vector or matrix of values.
+        axis (int): Axis along which values are ranked. Defaults to `0`.
+        nthreads (int): Number of threads sharing the columns. Defaults to
+                        `1`.
+
+    Returns:
+        Gaussian-normalized values, with the same shape as `x`.
+    """
+    x = asarray(x, float)
+    if x.ndim == 1:
+        return _gaussianize_columns(x[:, newaxis])[:, 0]
+
+    X = x if axis == 0 else x.T
+
+    if nthreads <= 1 or X.shape[1] < 2 * nthreads:
+        Y = _gaussianize_columns(X)
+    else:
+        pool = ThreadPool(nthreads)
+        try:
+            parts = pool.map(_gaussianize_columns,
+                             array_split(X, nthreads, axis=1))
+        finally:
+            pool.close()
+            pool.join()
+        Y = concatenate(parts, axis=1)
+
+    return Y if axis == 0 else Y.T
+
+
+def _gaussianize_columns(X):
+    (n, m) = X.shape
+    ok = isfinite(X)
+    cols = arange(m)
+
+    Z = where(ok, X, inf)
+    order = argsort(Z, axis=0, kind='mergesort')
+    S = Z[order, cols]
+
+    # Positions of the first and last element of each run of ties.
+    idx = arange(n)[:, newaxis]
+    change = S[1:] != S[:-1]
+
+    first = where(concatenate([[[True] * m], change]), idx, 0)
+    first = maximum.accumulate(first, axis=0)
+
+    last = where(concatenate([change, [[True] * m]]), idx, n - 1)
+    last = minimum.accumulate(last[::-1], axis=0)[::-1]
+
+    R = empty((n, m))
+    R[order, cols] = (first + last) / 2 + 1
+
+    Y = norm.ppf(R / (ok.sum(0) + 1))
+    Y[~ok] = X[~ok]
+    return Y
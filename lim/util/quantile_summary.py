@@ -1,21 +1,20 @@
 from numpy import asarray
-from numpy import median
 from numpy import percentile
 from tabulate import tabulate
 
+from .sketch import QuantileSketch
 
-def quantile_summary(v, floatfmt="g"):
-    v = asarray(v)
 
-    vmin = v.min()
-    v1q = percentile(v, 25)
-    medi = median(v)
-    v3q = percentile(v, 75)
-    vmax = v.max()
+def quantile_summary(v, floatfmt="g"):
+    """Min, quartiles and max of an array or of a :class:`QuantileSketch`."""
+    if isinstance(v, QuantileSketch):
+        q = v.quantile([0, 0.25, 0.5, 0.75, 1])
+    else:
+        q = percentile(asarray(v), [0, 25, 50, 75, 100])
 
     headers = ('Min', '1Q', 'Median', '3Q', 'Max')
     return tabulate(
-        [[vmin, v1q, medi, v3q, vmax]],
+        [list(q)],
         headers=headers,
         tablefmt="plain",
         floatfmt=floatfmt)
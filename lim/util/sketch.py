@@ -0,0 +1,137 @@
+from __future__ import division
+
+from math import ceil
+
+from numpy import argsort
+from numpy import asarray
+from numpy import atleast_1d
+from numpy import concatenate
+from numpy import cumsum
+from numpy import empty
+from numpy import full
+from numpy import inf
+from numpy import interp
+from numpy import isfinite
+from numpy import nan
+from numpy import sort
+from numpy.random import RandomState
+
+
+class QuantileSketch(object):
+    """Mergeable streaming quantile sketch.
+
+    A KLL-like sketch: values are held in levels of compactors, an item at
+    level :math:`h` standing for :math:`2^h` values. A level over capacity is
+    sorted and every other item is promoted to the next level, starting at a
+    random offset that then alternates between compactions of the level, so
+    that the errors of successive compactions cancel out. Memory stays in the order of `k` items whatever the
+    number of values, and the rank error of :meth:`quantile` is in the order
+    of :math:`1/k` of the count. The minimum and maximum are exact.
+
+    Non-finite values are ignored.
+
+    Args:
+        k (int): Accuracy parameter; the capacity of the top level. Defaults
+                 to `200`.
+        seed (int): Seed of the compaction offsets. Defaults to `0`.
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.count = 0
+        self.min = inf
+        self.max = -inf
+        self._levels = [empty(0)]
+        self._offsets = dict()
+        self._random = RandomState(seed)
+
+    @property
+    def size(self):
+        """Number of items held by the sketch."""
+        return sum(len(l) for l in self._levels)
+
+    def update(self, values):
+        """Add a block of values."""
+        values = asarray(values, float).ravel()
+        values = values[isfinite(values)]
+        if len(values) == 0:
+            return self
+
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._levels[0] = concatenate([self._levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Merge the values summarized by another sketch."""
+        if other.count == 0:
+            return self
+
+        while len(self._levels) < len(other._levels):
+            self._levels.append(empty(0))
+
+        for (h, l) in enumerate(other._levels):
+            self._levels[h] = concatenate([self._levels[h], l])
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Approximate quantiles for probabilities `q`."""
+        q = asarray(q, float)
+        r = atleast_1d(q).ravel()
+
+        if self.count == 0:
+            out = full(len(r), nan)
+        else:
+            items = concatenate(self._levels)
+            weights = concatenate(
+                [full(len(l), 2.0**h) for (h, l) in enumerate(self._levels)])
+            i = argsort(items, kind='mergesort')
+            items = items[i]
+            weights = weights[i]
+            cw = cumsum(weights)
+
+            # Each item stands for the values around the middle of its
+            # weight, not for the last of them: looking the ranks up at
+            # the upper ends would bias the quantiles of heavy items upward.
+            # Ranks are interpolated between the middles, which gives the
+            # linear percentiles of NumPy when nothing was compacted.
+            mid = cw - weights / 2
+            out = interp(mid[0] + r * (mid[-1] - mid[0]), mid, items)
+            out[r <= 0] = self.min
+            out[r >= 1] = self.max
+
+        return out.reshape(q.shape) if q.ndim > 0 else out[0]
+
+    def _capacity(self, h):
+        depth = len(self._levels) - h - 1
+        return max(2, int(ceil(self.k * (2 / 3)**depth)))
+
+    def _compress(self):
+        compacted = True
+        while compacted:
+            compacted = False
+            for h in range(len(self._levels)):
+                if len(self._levels[h]) > self._capacity(h):
+                    if h + 1 == len(self._levels):
+                        self._levels.append(empty(0))
+                    self._compact(h)
+                    compacted = True
+
+    def _compact(self, h):
+        l = sort(self._levels[h])
+        offset = self._offsets.get(h)
+        if offset is None:
+            offset = self._random.randint(2)
+        self._offsets[h] = 1 - offset
+
+        keep = l[len(l) - len(l) % 2:]
+        promoted = l[offset:len(l) - len(l) % 2:2]
+        self._levels[h] = keep
+        self._levels[h + 1] = concatenate([self._levels[h + 1], promoted])
@@ -0,0 +1,45 @@
+from numpy.testing import assert_equal
+from pytest import raises
+
+import logging
+
+from lim.util.memory import block_size
+from lim.util.memory import log_peak_memory
+from lim.util.memory import parse_memory
+from lim.util.memory import peak_memory
+
+
+def test_parse_memory():
+    assert_equal(parse_memory(1000), 1000)
+    assert_equal(parse_memory('2KB'), 2048)
+    assert_equal(parse_memory('1.5 GiB'), 3 * 1024**3 // 2)
+    assert_equal(parse_memory('3m'), 3 * 1024**2)
+    with raises(ValueError):
+        parse_memory('lots')
+
+
+def test_block_size():
+    assert_equal(block_size(1000, 100, 30), 30)
+    assert_equal(block_size('1KB', 24, 8, maximum=50), 50)
+    with raises(MemoryError):
+        block_size(100, 90, 20)
+
+
+def test_log_peak_memory(caplog):
+    peak = peak_memory()
+    if peak is None:
+        return
+
+    logger = logging.getLogger(__name__)
+    with caplog.at_level(logging.INFO):
+        # The process peak was reached before the call.
+        log_peak_memory(logger, 1024, start=peak)
+        log_peak_memory(logger, 1024, start=0)
+
+    assert [r.levelno for r in caplog.records] == [logging.INFO,
+                                                   logging.WARNING]
+    assert 'Process peak memory' in caplog.records[0].getMessage()
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
@@ -1,4 +1,5 @@
 from numpy import array, nan
+from numpy.random import RandomState
 from numpy.testing import assert_allclose
 
 from lim.util.preprocess import quantile_gaussianize
@@ -11,3 +12,17 @@ def test_quantile_gaussianize():
         nan, 0.15731068461, 1.150349380376, -1.150349380376, 0.674489750196,
         -0.318639363964, -0.674489750196, 0.15731068461
     ])
+
+
+def test_quantile_gaussianize_matrix():
+    random = RandomState(0)
+    X = random.randint(0, 5, (30, 7)).astype(float)
+    X[3, 2] = nan
+    X0 = X.copy()
+
+    Y = quantile_gaussianize(X)
+    assert_allclose(X, X0)
+    for j in range(X.shape[1]):
+        assert_allclose(Y[:, j], quantile_gaussianize(X[:, j]))
+
+    assert_allclose(quantile_gaussianize(X.T, axis=1, nthreads=2), Y.T)
@@ -0,0 +1,35 @@
+from __future__ import division
+
+from numpy import array_split
+from numpy import mean
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+
+from lim.util import QuantileSketch
+from lim.util import quantile_summary
+
+
+def test_quantile_sketch():
+    x = RandomState(0).randn(100000)
+    q = [0, 0.1, 0.5, 0.9, 1]
+
+    a = QuantileSketch(k=200)
+    b = QuantileSketch(k=200, seed=1)
+    for (i, block) in enumerate(array_split(x, 20)):
+        (a if i % 2 == 0 else b).update(block)
+    a.merge(b)
+
+    assert_equal(a.count, len(x))
+    assert a.size < 1000
+
+    e = a.quantile(q)
+    assert_allclose([mean(x <= ei) for ei in e], q, atol=0.02)
+    assert_equal(e[[0, -1]], [x.min(), x.max()])
+
+    assert_equal(
+        quantile_summary(QuantileSketch().update([1, 2, 3, 4, 5])),
+        quantile_summary([1, 2, 3, 4, 5]))
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
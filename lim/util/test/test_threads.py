@@ -0,0 +1,68 @@
+import sys
+import warnings
+from threading import Event
+from threading import Thread
+
+import pytest
+
+from lim.util import blas_threads
+
+
+def _blas_threads():
+    from threadpoolctl import threadpool_info
+    return [i['num_threads'] for i in threadpool_info()
+            if i['user_api'] == 'blas']
+
+
+def test_blas_threads():
+    pytest.importorskip('threadpoolctl')
+
+    with blas_threads(None):
+        pass
+
+    before = _blas_threads()
+    with blas_threads(1):
+        assert all(n == 1 for n in _blas_threads())
+    assert _blas_threads() == before
+
+
+def test_blas_threads_interleaved():
+    pytest.importorskip('threadpoolctl')
+
+    before = _blas_threads()
+    (entered, left) = (Event(), Event())
+
+    def first():
+        with blas_threads(1):
+            entered.set()
+            left.wait()
+
+    t = Thread(target=first)
+    t.start()
+    entered.wait()
+
+    # The first block exits while the second one is in progress.
+    with blas_threads(2):
+        left.set()
+        t.join()
+        assert all(n <= 2 for n in _blas_threads())
+
+    assert _blas_threads() == before
+
+
+def test_blas_threads_unavailable(monkeypatch):
+    # Importing a module set to None raises ImportError.
+    monkeypatch.setitem(sys.modules, 'threadpoolctl', None)
+
+    with pytest.warns(RuntimeWarning):
+        with blas_threads(1):
+            pass
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with blas_threads(None):
+            pass
+
+
+if __name__ == '__main__':
+    __import__('pytest').main([__file__, '-s'])
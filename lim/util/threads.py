@@ -0,0 +1,67 @@
+from __future__ import absolute_import, division
+
+import warnings
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+from threading import Lock
+
+# The BLAS limit is process-wide: blocks entered from several threads share
+# it. `_active` holds the limit of each block in progress and `_original`
+# the limiter able to restore the limits found before the first one.
+_lock = Lock()
+_active = []
+_original = []
+
+
+@contextmanager
+def blas_threads(nthreads):
+    """Limit the number of BLAS/LAPACK threads within a block.
+
+    The limit applies to the whole process. Blocks may be entered and left
+    from several threads in any order: the smallest limit among the blocks
+    in progress applies, and the limits found before the first block are
+    restored when the last one exits. It relies on the `threadpoolctl`
+    package, required on Python 3.5 or later; without it (e.g., on Python
+    2.7), a :class:`RuntimeWarning` is issued and the environment settings
+    are left untouched. ``None`` means no limit.
+
+    Args:
+        nthreads (int): Maximum number of BLAS threads.
+    """
+    if nthreads is None:
+        yield
+        return
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        warnings.warn('The number of BLAS threads cannot be limited to %d '
+                      'without threadpoolctl.' % nthreads, RuntimeWarning,
+                      stacklevel=3)
+        yield
+        return
+
+    with _lock:
+        _active.append(nthreads)
+        _apply(threadpool_limits)
+    try:
+        yield
+    finally:
+        with _lock:
+            _active.remove(nthreads)
+            _apply(threadpool_limits)
+
+
+def _apply(threadpool_limits):
+    if len(_active) == 0:
+        _original.pop().restore_original_limits()
+        return
+
+    limiter = threadpool_limits(limits=min(_active), user_api='blas')
+    if len(_original) == 0:
+        _original.append(limiter)
+
+
+def threads_per_process(nprocs):
+    """BLAS threads per worker so that `nprocs` workers fill the CPUs."""
+    return max(1, cpu_count() // max(nprocs, 1))
@@ -2,13 +2,15 @@ from __future__ import division
 
 from numpy import sqrt
 
+from ..tool.normalize import OnlineStandardizer
+
 
 class DesignMatrixTrans(object):
     def __init__(self, G):
-        self._sub = G.mean(0)
-        self._div = G.std(0)
-        self._div[self._div == 0] = 1.0
-        self._div *= sqrt(G.shape[1])
+        self._stats = OnlineStandardizer(G.shape[1]).partial_fit(G)
+        self._scale = sqrt(G.shape[1])
 
-    def transform(self, X):
-        return (X - self._sub) / self._div
+    def transform(self, X, out=None):
+        out = self._stats.transform(X, out=out)
+        out /= self._scale
+        return out
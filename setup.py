@@ -25,7 +25,8 @@ def setup_package():
     install_requires = [
         'pytest>=2.9', 'scipy', 'numpy', 'cffi>=1.7', 'numpy-sugar', 'tqdm',
         'h5py', 'pandas', 'tabulate>=0.7', 'six', 'optimix',
-        'limix-inference>=1.0.15', 'cachetools>=2.0'
+        'limix-inference>=1.0.15', 'cachetools>=2.0',
+        'threadpoolctl; python_version >= "3.5"'
     ]
     tests_require = install_requires
 
@@ -44,6 +45,12 @@ def setup_package():
         setup_requires=setup_requires,
         tests_require=tests_require,
         include_package_data=True,
+        entry_points={
+            'console_scripts': [
+                'lim-scan = lim.genetics.qtl.cli:main',
+                'lim-merge = lim.genetics.qtl.cli:merge_main'
+            ]
+        },
         classifiers=[
             "Development Status :: 5 - Production/Stable",
             "License :: OSI Approved :: MIT License",